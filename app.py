@@ -1,92 +1,1355 @@
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, g, request, session, jsonify, render_template_string
+from flask.json.provider import DefaultJSONProvider
+import base64
+import binascii
+import bisect
+import collections
+import codecs
+import contextlib
+import contextvars
+import csv
 import datetime
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import logging
+import logging.handlers
+import math
+import mmap
+import os
+import queue
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
 from textblob import TextBlob
 
+try:
+    import fcntl
+except ImportError:  # Windows: the data directory lock is skipped
+    fcntl = None
+
+# Optional accelerators: orjson for JSON, brotli for response compression.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 app = Flask(__name__)
 
+# --- Tracing ---
+# Sampled requests record spans for their stages (JSON parse/serialize, store,
+# TextBlob) and are exported as OTLP/JSON lines, one ExportTraceServiceRequest
+# per request, to a rotating file. Tracing is off unless RHYTHM_TRACE_FILE is set.
+
+TRACE_FILE = os.environ.get('RHYTHM_TRACE_FILE')
+TRACE_SAMPLE_RATE = float(os.environ.get('RHYTHM_TRACE_SAMPLE_RATE', '0.1'))
+TRACE_MAX_BYTES = int(os.environ.get('RHYTHM_TRACE_MAX_BYTES', str(10 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.environ.get('RHYTHM_TRACE_BACKUPS', '5'))
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+SPAN_KIND_INTERNAL, SPAN_KIND_SERVER = 1, 2
+STATUS_CODE_ERROR = 2
+
+current_trace = contextvars.ContextVar('current_trace', default=None)
+trace_logger = logging.getLogger('rhythm.trace')
+trace_logger.propagate = False
+trace_listener = None
+
+def _init_tracing():
+    """Writes finished traces from a background thread so requests never block on file I/O."""
+    global trace_listener
+    if not TRACE_FILE or trace_listener:
+        return
+    handler = logging.handlers.RotatingFileHandler(TRACE_FILE, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    records = queue.SimpleQueue()
+    trace_logger.addHandler(logging.handlers.QueueHandler(records))
+    trace_logger.setLevel(logging.INFO)
+    trace_listener = logging.handlers.QueueListener(records, handler)
+    trace_listener.start()
+
+def _otlp_attributes(attributes):
+    converted = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            converted.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            converted.append({"key": key, "value": {"intValue": str(value)}})
+        elif isinstance(value, float):
+            converted.append({"key": key, "value": {"doubleValue": value}})
+        else:
+            converted.append({"key": key, "value": {"stringValue": str(value)}})
+    return converted
+
+class _Span:
+    """Times one stage of a sampled request as a child of the innermost open span."""
+
+    __slots__ = ('trace', 'name', 'attributes', 'span_id', 'parent_id', 'start')
+
+    def __init__(self, trace, name, attributes):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        stack = self.trace['stack']
+        self.parent_id = stack[-1]
+        self.span_id = f"{random.getrandbits(64):016x}"
+        stack.append(self.span_id)
+        self.start = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.time_ns()
+        self.trace['stack'].pop()
+        span = {
+            "traceId": self.trace['trace_id'],
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "kind": SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(end),
+            "attributes": _otlp_attributes(self.attributes),
+        }
+        if exc_type is not None:
+            span["status"] = {"code": STATUS_CODE_ERROR, "message": exc_type.__name__}
+        self.trace['spans'].append(span)
+        return False
+
+_NO_SPAN = contextlib.nullcontext()
+
+def _span(name, **attributes):
+    """Context manager for a stage span; a shared no-op outside sampled requests."""
+    trace = current_trace.get()
+    return _NO_SPAN if trace is None else _Span(trace, name, attributes)
+
+def _should_sample(trace_id, flags):
+    if flags is not None:
+        return bool(int(flags, 16) & 1)  # parent-based: follow the caller's decision
+    # Ratio sampling on the trace id, so every service keeps the same traces.
+    return int(trace_id[16:], 16) < TRACE_SAMPLE_RATE * 2 ** 64
+
+@app.before_request
+def start_trace():
+    """Continues the caller's W3C trace context, or starts a new trace, and samples it."""
+    if not trace_listener:
+        return None
+    trace_id = parent_id = flags = None
+    match = TRACEPARENT_RE.match(request.headers.get('traceparent', ''))
+    if match and match.group(1) != '0' * 32 and match.group(2) != '0' * 16:
+        trace_id, parent_id, flags = match.groups()
+    trace_id = trace_id or f"{random.getrandbits(128) or 1:032x}"
+    if not _should_sample(trace_id, flags):
+        return None
+    span_id = f"{random.getrandbits(64):016x}"
+    trace = {
+        "trace_id": trace_id,
+        "stack": [span_id],
+        "spans": [],
+        "root": {
+            "traceId": trace_id,
+            "spanId": span_id,
+            "parentSpanId": parent_id or "",
+            "name": f"{request.method} {request.url_rule.rule if request.url_rule else request.path}",
+            "kind": SPAN_KIND_SERVER,
+            "startTimeUnixNano": str(time.time_ns()),
+        },
+        "attributes": {"http.request.method": request.method, "url.path": request.path},
+    }
+    if request.url_rule:
+        trace['attributes']['http.route'] = request.url_rule.rule
+    g.trace_token = current_trace.set(trace)
+    return None
+
+@app.after_request
+def record_trace_status(response):
+    trace = current_trace.get()
+    if trace is not None:
+        trace['attributes']['http.response.status_code'] = response.status_code
+        if response.status_code >= 500:
+            trace['root']['status'] = {"code": STATUS_CODE_ERROR}
+    return response
+
+@app.teardown_request
+def export_trace(exc=None):
+    token = g.pop('trace_token', None)
+    if token is None:
+        return
+    trace = current_trace.get()
+    current_trace.reset(token)
+    root = trace['root']
+    root['endTimeUnixNano'] = str(time.time_ns())
+    root['attributes'] = _otlp_attributes(trace['attributes'])
+    if exc is not None:
+        root['status'] = {"code": STATUS_CODE_ERROR, "message": type(exc).__name__}
+    trace_logger.info(_json_dumps({"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "rhythm"}}]},
+        "scopeSpans": [{"scope": {"name": "rhythm"}, "spans": [root, *trace['spans']]}],
+    }]}))
+
+# --- JSON encoding ---
+
+def _json_dumps(obj):
+    """Encodes obj to a JSON string with orjson when available."""
+    return orjson.dumps(obj).decode() if orjson else json.dumps(obj)
+
+_json_loads = orjson.loads if orjson else json.loads
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that uses orjson when it is installed and the stdlib otherwise."""
+
+    def dumps(self, obj, **kwargs):
+        if orjson and not kwargs:
+            return self._orjson_dumps(obj).decode()
+        return super().dumps(obj, **kwargs)
+
+    def loads(self, s, **kwargs):
+        with _span('json.parse', bytes=len(s)):
+            if orjson and not kwargs:
+                return orjson.loads(s)
+            return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        with _span('json.serialize'):
+            if not orjson:
+                return super().response(*args, **kwargs)
+            obj = self._prepare_response_obj(args, kwargs)
+            return self._app.response_class(self._orjson_dumps(obj) + b"\n", mimetype=self.mimetype)
+
+    def _orjson_dumps(self, obj):
+        option = orjson.OPT_SORT_KEYS if self.sort_keys else 0
+        if self._app.debug:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option)
+
+app.json = FastJSONProvider(app)
+
 # --- In-memory storage ---
-user_activity_log = []
-mock_tasks = []
+# State is partitioned per tenant (the caller, see _current_user). Tenants are
+# hash-sharded over STORE_SHARDS shards with one lock each, so requests for
+# different tenants rarely contend and never scan each other's data.
+
+STORE_SHARDS = max(1, int(os.environ.get('RHYTHM_STORE_SHARDS', '16')))
+# Per-tenant quotas; writes that would pass them are refused with 403.
+TENANT_MAX_TASKS = int(os.environ.get('RHYTHM_TENANT_MAX_TASKS', '10000'))
+TENANT_MAX_ACTIVITIES = int(os.environ.get('RHYTHM_TENANT_MAX_ACTIVITIES', '1000000'))
+TENANT_MAX_JOURNAL_ENTRIES = int(os.environ.get('RHYTHM_TENANT_MAX_JOURNAL_ENTRIES', '100000'))
+# Tenants held in memory, split evenly over the shards. When a shard is full, empty
+# tenants idle for TENANT_IDLE_SECONDS are dropped to make room; creating a tenant
+# fails with 403 if none can be.
+MAX_TENANTS = int(os.environ.get('RHYTHM_MAX_TENANTS', '100000'))
+TENANT_IDLE_SECONDS = 300
+
+# With a secret key, browsers that send no X-User-Id get their own tenant via the session cookie.
+app.secret_key = os.environ.get('RHYTHM_SECRET_KEY')
+
+def _current_user():
+    """Identifies the caller from the X-User-Id header, then the session ('default' otherwise)."""
+    user = (request.headers.get('X-User-Id') or '').strip()
+    if not user and app.secret_key:
+        user = session.get('user_id')
+    return user or 'default'
+
+class Tenant:
+    """One tenant's partition of the store; guarded by its shard's lock."""
+
+    def __init__(self, name):
+        self.name = name
+        self.tasks = []
+        self.task_queue = TaskQueue()
+        self.activities = ActivityIndex()
+        self.journal = JournalIndex()
+        # Bumped on every activity append so cached views can tell when they are stale.
+        self.version = 0
+        # Rendered synthesis: {"day", "version", "etag", "summary"}
+        self.synthesis = None
+        self.last_used = time.monotonic()
+
+    def is_empty(self):
+        return not self.tasks and not len(self.activities) and not self.journal.entries
+
+class StoreShard:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.tenants = {}
+
+store_shards = [StoreShard() for _ in range(STORE_SHARDS)]
+SHARD_MAX_TENANTS = max(1, math.ceil(MAX_TENANTS / STORE_SHARDS))
+
+def _tenant(name=None, create=True):
+    """
+    Returns (shard, tenant) for the named tenant (the caller by default).
+    A new tenant is created on first use; read paths pass create=False and get
+    an empty, unregistered tenant instead, so lookups never grow the store.
+    """
+    name = name or _current_user()
+    shard = store_shards[zlib.crc32(name.encode()) % STORE_SHARDS]
+    # Looked up and touched under the lock that eviction holds, so a tenant is
+    # never handed out just as it is dropped. Callers that hold on to a tenant
+    # for long (imports) look it up again before each write.
+    with shard.lock:
+        tenant = shard.tenants.get(name)
+        if tenant is None:
+            if not create:
+                return shard, Tenant(name)
+            if len(shard.tenants) >= SHARD_MAX_TENANTS:
+                _evict_idle_tenants(shard)
+            tenant = shard.tenants[name] = Tenant(name)
+        tenant.last_used = time.monotonic()
+    return shard, tenant
+
+def _evict_idle_tenants(shard):
+    """Drops the shard's empty, idle tenants (call with its lock held); QuotaExceeded if none are."""
+    cutoff = time.monotonic() - TENANT_IDLE_SECONDS
+    idle = [name for name, tenant in shard.tenants.items() if tenant.is_empty() and tenant.last_used < cutoff]
+    if not idle:
+        raise QuotaExceeded(f"Tenant limit of {MAX_TENANTS} reached")
+    for name in idle:
+        del shard.tenants[name]
+
+@contextlib.contextmanager
+def _all_shards_locked():
+    """Holds every shard lock (in shard order) for a consistent view of the whole store."""
+    with contextlib.ExitStack() as stack:
+        for shard in store_shards:
+            stack.enter_context(shard.lock)
+        yield
+
+class QuotaExceeded(Exception):
+    """Raised when a write would take a tenant past one of its quotas."""
+
+@app.errorhandler(QuotaExceeded)
+def quota_exceeded(error):
+    return jsonify({"status": "error", "message": str(error)}), 403
+
+def _check_quota(tenant, tasks=0, activities=0, journal_entries=0):
+    """Raises QuotaExceeded if adding these counts would pass one of the tenant's quotas."""
+    if tasks and len(tenant.tasks) + tasks > TENANT_MAX_TASKS:
+        raise QuotaExceeded(f"Task quota of {TENANT_MAX_TASKS} reached")
+    if activities and len(tenant.activities) + activities > TENANT_MAX_ACTIVITIES:
+        raise QuotaExceeded(f"Activity quota of {TENANT_MAX_ACTIVITIES} reached")
+    if journal_entries and len(tenant.journal.entries) + journal_entries > TENANT_MAX_JOURNAL_ENTRIES:
+        raise QuotaExceeded(f"Journal quota of {TENANT_MAX_JOURNAL_ENTRIES} reached")
+
+ACTIVITY_KINDS = ('flow_block', 'journal', 'breathing', 'other')
+
+def _activity_kind(entry):
+    """Classifies an activity entry, preferring its structured kind when present."""
+    kind = entry.get('kind')
+    if kind in ACTIVITY_KINDS:
+        return kind
+    activity = entry['activity']
+    if "Flow Block" in activity:
+        return 'flow_block'
+    if "journal entry" in activity:
+        return 'journal'
+    if "breathing exercise" in activity:
+        return 'breathing'
+    return 'other'
+
+def _normalize_timestamp(value):
+    """
+    Parses an ISO 8601 datetime into the naive local isoformat() the activity log
+    uses, so stored timestamps sort correctly as strings. Raises ValueError.
+    """
+    moment = datetime.datetime.fromisoformat(value)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone().replace(tzinfo=None)
+    return moment.isoformat()
+
+class ActivityIndex:
+    """
+    One user's activity entries sorted by (timestamp, arrival), plus one sorted
+    list per kind. Range reads bisect into the list and slice: O(log n + k).
+    """
+
+    def __init__(self):
+        self.keys = {'all': []}
+        self.entries = {'all': []}
+        self.arrivals = 0
+
+    def __len__(self):
+        return len(self.keys['all'])
+
+    def add(self, entry):
+        self.arrivals += 1
+        key = (entry['timestamp'], self.arrivals)
+        for kind in ('all', _activity_kind(entry)):
+            keys = self.keys.setdefault(kind, [])
+            entries = self.entries.setdefault(kind, [])
+            if not keys or keys[-1] <= key:
+                keys.append(key)
+                entries.append(entry)
+            else:  # out-of-order timestamp (e.g. an import)
+                position = bisect.bisect(keys, key)
+                keys.insert(position, key)
+                entries.insert(position, entry)
+
+    def query(self, kind='all', date_from=None, date_to=None, after=None, limit=100):
+        """Returns (entries, key of the last entry if more remain) in timestamp order."""
+        keys = self.keys.get(kind, [])
+        lo = bisect.bisect_left(keys, (date_from,)) if date_from else 0
+        if after:
+            lo = max(lo, bisect.bisect_right(keys, after))
+        hi = bisect.bisect_right(keys, (date_to, math.inf)) if date_to else len(keys)
+        end = min(hi, lo + limit)
+        next_key = keys[end - 1] if end < hi else None
+        return self.entries.get(kind, [])[lo:end], next_key
+
+TASK_LOADS = ('High', 'Medium', 'Low')
+
+class TaskQueue:
+    """
+    One min-heap of (task id, entry token) per cognitive load, so each heap yields
+    its oldest task first. Deleting or re-filing a task only forgets its live
+    token; stale heap entries are skipped on read and dropped when they outnumber
+    the live ones.
+    """
+
+    def __init__(self):
+        self.heaps = {load: [] for load in TASK_LOADS}
+        self.live = {}  # task id -> (load, token, task)
+        self.tokens = 0
+        self.stale = 0
+
+    def put(self, task):
+        self.discard(task['id'])
+        self.tokens += 1
+        load = task['cognitive_load']
+        self.live[task['id']] = (load, self.tokens, task)
+        heapq.heappush(self.heaps[load], (task['id'], self.tokens))
+
+    def discard(self, task_id):
+        if self.live.pop(task_id, None) is not None:
+            self.stale += 1
+            if self.stale > 64 and self.stale > len(self.live):
+                self._compact()
+
+    def _compact(self):
+        for load, heap in self.heaps.items():
+            heap[:] = [entry for entry in heap if self._is_live(load, entry)]
+            heapq.heapify(heap)
+        self.stale = 0
+
+    def _is_live(self, load, entry):
+        current = self.live.get(entry[0])
+        return current is not None and current[0] == load and current[1] == entry[1]
+
+    def top(self, weights, k):
+        """
+        Returns up to k tasks ordered by load weight (highest first), then age.
+        Each heap array is walked as a tree from its root through a small frontier
+        heap, so only O(k) entries (plus stale ones) are touched: O(k log k).
+        """
+        frontier = [(-weights[load], heap[0][0], load, 0) for load, heap in self.heaps.items() if heap]
+        heapq.heapify(frontier)
+        tasks = []
+        while frontier and len(tasks) < k:
+            negative_weight, _, load, index = heapq.heappop(frontier)
+            heap = self.heaps[load]
+            if self._is_live(load, heap[index]):
+                tasks.append(self.live[heap[index][0]][2])
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (negative_weight, heap[child][0], load, child))
+        return tasks
+
+def _append_activities(tenant, entries):
+    """Adds entries to the tenant's activity index (call with its shard lock held)."""
+    for entry in entries:
+        tenant.activities.add(entry)
+    tenant.version += 1
+
+def _log_event(activity, user=None, **details):
+    """
+    Appends an activity to the user's log and bumps its version.
+    Extra keyword arguments are stored on the entry as structured fields.
+    """
+    entry = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "activity": activity,
+        "user": user or _current_user(),
+        **details
+    }
+    shard, tenant = _tenant(entry['user'])
+    with _span('store.write', op='activity.append'), shard.lock:
+        _check_quota(tenant, activities=1)
+        _append_activities(tenant, [entry])
+        seq = _persist('activity.append', entries=[entry])
+    _wait_durable(seq)
+    return entry
+
+# --- Persistence (optional write-ahead log + snapshots) ---
+
+# Persistence is enabled by pointing RHYTHM_DATA_DIR at a writable directory.
+DATA_DIR = os.environ.get('RHYTHM_DATA_DIR')
+# 'always': a write returns once its record is fsynced (group commit);
+# 'batch': the writer thread fsyncs in the background; 'off': never fsync.
+WAL_FSYNC = os.environ.get('RHYTHM_WAL_FSYNC', 'always')
+# How long the writer waits to gather more records into one commit.
+WAL_COMMIT_DELAY = float(os.environ.get('RHYTHM_WAL_COMMIT_MS', '2')) / 1000
+# Number of WAL records after which a compact snapshot is written.
+SNAPSHOT_EVERY = int(os.environ.get('RHYTHM_SNAPSHOT_EVERY', '100000'))
+
+wal = None
+
+class WriteAheadLog:
+    """
+    Append-only NDJSON log of store mutations with group commit.
+    Every SNAPSHOT_EVERY records the log is rotated and the store is written to a
+    compact snapshot; recovery loads the snapshot and replays the log tail.
+    """
+
+    def __init__(self, directory, fsync_mode='always', commit_delay=0.002, snapshot_every=100000):
+        if fsync_mode not in {'always', 'batch', 'off'}:
+            raise ValueError("RHYTHM_WAL_FSYNC must be always, batch, or off")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.wal_path = os.path.join(directory, 'wal.ndjson')
+        self.old_wal_path = os.path.join(directory, 'wal.old.ndjson')
+        self.snapshot_path = os.path.join(directory, 'snapshot.ndjson')
+        self.fsync_mode = fsync_mode
+        self.commit_delay = commit_delay
+        self.snapshot_every = snapshot_every
+        self.seq = 0
+        self._durable_seq = 0
+        self._pending = []
+        self._since_snapshot = 0
+        self._snapshotting = False
+        self._cond = threading.Condition()
+        self._file = None
+        self._lock_file = open(os.path.join(directory, 'LOCK'), 'a')
+        if fcntl:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                raise RuntimeError(f"{directory} is already in use by another Rhythm process")
+
+    # Recovery
+
+    def recover(self):
+        """Loads the snapshot and replays the WAL tail into the in-memory store."""
+        tasks_by_id, state, snapshot_seq = self._load_snapshot()
+        self.seq = snapshot_seq
+        replayed = 0
+        for path in (self.old_wal_path, self.wal_path):
+            replayed += self._replay(path, snapshot_seq, tasks_by_id, state)
+        self._durable_seq = self.seq
+        state['tasks'] = list(tasks_by_id.values())
+        _apply_recovered(state)
+
+        if replayed:
+            # Compact so the next start only has to read one snapshot.
+            self._write_snapshot(self.seq, state)
+        for path in (self.old_wal_path, self.wal_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self._file = open(self.wal_path, 'ab')
+        threading.Thread(target=self._writer, name='rhythm-wal', daemon=True).start()
+
+    def _load_snapshot(self):
+        tasks_by_id = {}  # (user, id) -> (user, task)
+        state = {"activities": [], "journal": []}
+        if not os.path.exists(self.snapshot_path) or os.path.getsize(self.snapshot_path) == 0:
+            return tasks_by_id, state, 0
+        with open(self.snapshot_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            header = _json_loads(mm.readline())
+            for line in iter(mm.readline, b''):
+                record = _json_loads(line)
+                if 't' in record:
+                    user = record.get('u', 'default')
+                    tasks_by_id[user, record['t']['id']] = (user, record['t'])
+                elif 'a' in record:
+                    state['activities'].append(record['a'])
+                else:
+                    state['journal'].append(record['j'])
+        return tasks_by_id, state, header['seq']
+
+    def _replay(self, path, after_seq, tasks_by_id, state):
+        if not os.path.exists(path):
+            return 0
+        replayed = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    record = _json_loads(line)
+                except ValueError:
+                    break  # torn tail from a crash mid-write
+                if record['seq'] <= after_seq:
+                    continue
+                op = record['op']
+                user = record.get('user', 'default')
+                if op == 'task.put':
+                    tasks_by_id[user, record['task']['id']] = (user, record['task'])
+                elif op == 'task.delete':
+                    tasks_by_id.pop((user, record['id']), None)
+                elif op == 'tasks.bulk':
+                    for task_id in record['deletes']:
+                        tasks_by_id.pop((user, task_id), None)
+                    for task in record['puts']:
+                        tasks_by_id[user, task['id']] = (user, task)
+                elif op == 'activity.append':
+                    state['activities'].extend(record['entries'])
+                elif op == 'journal.add':
+                    state['journal'].append(record['entry'])
+                self.seq = record['seq']
+                replayed += 1
+        return replayed
+
+    # Writing
+
+    def append(self, op, **payload):
+        """Queues a record. Call with the shard lock held so log order matches apply order."""
+        with self._cond:
+            self.seq += 1
+            self._pending.append(_json_dumps({"seq": self.seq, "op": op, **payload}) + "\n")
+            self._since_snapshot += 1
+            self._cond.notify_all()
+            return self.seq
+
+    def wait_durable(self, seq):
+        """Blocks until seq has been committed (only in 'always' mode)."""
+        if self.fsync_mode != 'always':
+            return
+        with self._cond:
+            while self._durable_seq < seq:
+                self._cond.wait()
+
+    def _writer(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            if self.commit_delay:
+                time.sleep(self.commit_delay)
+
+            if self._since_snapshot >= self.snapshot_every and not self._snapshotting:
+                self._rotate()
+                continue
+
+            with self._cond:
+                batch, self._pending = self._pending, []
+                last_seq = self.seq
+            self._commit(batch, last_seq)
+
+    def _commit(self, batch, last_seq):
+        self._file.write("".join(batch).encode())
+        self._file.flush()
+        if self.fsync_mode != 'off':
+            os.fsync(self._file.fileno())
+        with self._cond:
+            self._durable_seq = last_seq
+            self._cond.notify_all()
+
+    def _rotate(self):
+        # Holding every shard lock means every applied mutation is already
+        # queued, so the copied state corresponds exactly to snapshot_seq.
+        with _all_shards_locked():
+            with self._cond:
+                batch, self._pending = self._pending, []
+                snapshot_seq = self.seq
+                self._since_snapshot = 0
+                self._snapshotting = True
+            state = _snapshot_state()
+        self._commit(batch, snapshot_seq)
+        self._file.close()
+        os.replace(self.wal_path, self.old_wal_path)
+        self._file = open(self.wal_path, 'ab')
+        threading.Thread(
+            target=self._finish_snapshot, args=(snapshot_seq, state),
+            name='rhythm-snapshot', daemon=True
+        ).start()
+
+    def _finish_snapshot(self, snapshot_seq, state):
+        try:
+            self._write_snapshot(snapshot_seq, state)
+            os.remove(self.old_wal_path)
+        finally:
+            self._snapshotting = False
+
+    def _write_snapshot(self, snapshot_seq, state):
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"seq": snapshot_seq, **{k: len(v) for k, v in state.items()}}) + "\n")
+            for user, task in state['tasks']:
+                f.write(_json_dumps({"u": user, "t": task}) + "\n")
+            for tag, key in (('a', 'activities'), ('j', 'journal')):
+                for item in state[key]:
+                    f.write(_json_dumps({tag: item}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        if hasattr(os, 'O_DIRECTORY'):
+            dir_fd = os.open(self.directory, os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+def _persist(op, **payload):
+    """Records a mutation in the WAL (call with the shard lock held); returns its sequence number."""
+    return wal.append(op, **payload) if wal else 0
+
+def _wait_durable(seq):
+    if wal and seq:
+        with _span('wal.wait_durable', seq=seq):
+            wal.wait_durable(seq)
+
+def _snapshot_state():
+    """Shallow copies of everything the WAL persists (call with every shard locked)."""
+    tenants = [tenant for shard in store_shards for tenant in shard.tenants.values()]
+    return {
+        "tasks": [(tenant.name, task) for tenant in tenants for task in tenant.tasks],
+        "activities": [entry for tenant in tenants for entry in tenant.activities.entries['all']],
+        "journal": [entry for tenant in tenants for entry in tenant.journal.entries]
+    }
+
+def _restored_tenant(name):
+    """Like _tenant, but never refused: recovered tenants hold data and are kept past the cap."""
+    shard = store_shards[zlib.crc32(name.encode()) % STORE_SHARDS]
+    return shard.tenants.setdefault(name, Tenant(name))
+
+def _apply_recovered(state):
+    for shard in store_shards:
+        shard.tenants.clear()
+    for user, task in state['tasks']:
+        tenant = _restored_tenant(user)
+        tenant.tasks.append(task)
+        tenant.task_queue.put(task)
+    # Sorted first (stably, keeping arrival order for equal timestamps) so the
+    # index only appends instead of inserting into the middle of its lists.
+    for entry in sorted(state['activities'], key=lambda entry: entry['timestamp']):
+        _restored_tenant(entry.get('user', 'default')).activities.add(entry)
+    for entry in state['journal']:
+        _restored_tenant(entry['user']).journal.add(entry)
+
+def _init_persistence():
+    """Opens the WAL and restores the store when RHYTHM_DATA_DIR is configured."""
+    global wal
+    if not DATA_DIR or wal:
+        return
+    wal = WriteAheadLog(DATA_DIR, WAL_FSYNC, WAL_COMMIT_DELAY, SNAPSHOT_EVERY)
+    wal.recover()
+
+# --- Rate limiting ---
+
+# Token buckets per client (a known X-API-Key, else IP) and route. Set RHYTHM_RATE_LIMIT=0 to disable.
+RATE_LIMIT_ENABLED = os.environ.get('RHYTHM_RATE_LIMIT', '1') != '0'
+# Comma-separated API keys that get their own buckets; any other key is limited by IP.
+RATE_LIMIT_API_KEYS = frozenset(key.strip() for key in os.environ.get('RHYTHM_API_KEYS', '').split(',') if key.strip())
+RATE_LIMIT_CAPACITY = float(os.environ.get('RHYTHM_RATE_LIMIT_CAPACITY', '60'))
+RATE_LIMIT_REFILL_PER_SECOND = float(os.environ.get('RHYTHM_RATE_LIMIT_REFILL', '1'))
+# Path of an mmap'd file shared by all worker processes; per-process buckets otherwise.
+RATE_LIMIT_SHM_PATH = os.environ.get('RHYTHM_RATE_LIMIT_SHM')
+# Tokens each request takes from its bucket; endpoints not listed cost 1.
+ROUTE_COSTS = {
+    'analyze_sentiment': 5,
+    'generate_synthesis': 5,
+    'get_synthesis': 2,
+    'save_journal_entry': 5,
+    'bulk_tasks': 5,
+    'export_tasks': 5,
+    'export_activities': 5,
+    'import_tasks': 10,
+    'import_activities': 10
+}
+RATE_LIMIT_EXEMPT = {'index', 'service_worker', 'static'}
+
+def _refill(tokens, last, now):
+    return min(RATE_LIMIT_CAPACITY, tokens + (now - last) * RATE_LIMIT_REFILL_PER_SECOND)
+
+class TokenBucketStore:
+    """In-process token buckets keyed by client and route, least recently used first."""
+
+    # Above this many buckets, the least recently used one is dropped.
+    MAX_BUCKETS = 100000
+
+    def __init__(self):
+        self.buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, cost, now):
+        """Takes `cost` tokens if available; returns (allowed, tokens left)."""
+        with self._lock:
+            tokens, last = self.buckets.pop(key, (RATE_LIMIT_CAPACITY, now))
+            tokens = _refill(tokens, last, now)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.MAX_BUCKETS:
+                self.buckets.popitem(last=False)
+        return allowed, tokens
+
+class SharedSlotFile:
+    """
+    Fixed-size slot table in an mmap'd file shared by every worker process.
+    Subclasses define SLOT (the struct of one slot) and SETTING (the variable
+    that configured the path, for errors). Writers hold _exclusive().
+    """
+
+    SETTING = None
+
+    def __init__(self, path, slots=65536):
+        if not fcntl:
+            raise RuntimeError(f"{self.SETTING} requires fcntl (POSIX)")
+        self.slots = slots
+        size = slots * self.SLOT.size
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()  # flock does not exclude threads of one process
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        """Holds the file lock against other processes and the thread lock against this one."""
+        with self._lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+class SharedTokenBucketStore(SharedSlotFile):
+    """
+    Token buckets in a fixed-size mmap'd file shared by every worker process.
+    Each slot holds (key hash, tokens, last update) and is found by linear probing;
+    when a probe window is full the least recently updated slot is reused.
+    Updates hold an exclusive fcntl lock on the file.
+    """
+
+    SETTING = 'RHYTHM_RATE_LIMIT_SHM'
+    SLOT = struct.Struct('<Qdd')
+    PROBES = 16
+
+    def take(self, key, cost, now):
+        key_hash = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+        start = key_hash % self.slots
+        with self._exclusive():
+            target, tokens, last = None, RATE_LIMIT_CAPACITY, now
+            oldest = None
+            for probe in range(self.PROBES):
+                index = (start + probe) % self.slots
+                slot_hash, slot_tokens, slot_last = self.SLOT.unpack_from(self._map, index * self.SLOT.size)
+                if slot_hash == key_hash:
+                    target, tokens, last = index, slot_tokens, slot_last
+                    break
+                if slot_hash == 0:
+                    target = index
+                    break
+                if oldest is None or slot_last < oldest[1]:
+                    oldest = (index, slot_last)
+            if target is None:
+                target = oldest[0]
+
+            tokens = _refill(tokens, last, now)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self.SLOT.pack_into(self._map, target * self.SLOT.size, key_hash, tokens, now)
+        return allowed, tokens
+
+rate_limiter = None
+if RATE_LIMIT_ENABLED:
+    rate_limiter = SharedTokenBucketStore(RATE_LIMIT_SHM_PATH) if RATE_LIMIT_SHM_PATH else TokenBucketStore()
+
+def _rate_limit_client():
+    """A recognised API key, else the IP; unknown keys must not mint fresh buckets."""
+    api_key = (request.headers.get('X-API-Key') or '').strip()
+    return f"key:{api_key}" if api_key in RATE_LIMIT_API_KEYS else f"ip:{request.remote_addr}"
+
+@app.before_request
+def enforce_rate_limit():
+    """Charges the request's cost to its client/route bucket; 429 when it is empty."""
+    if not rate_limiter or request.endpoint is None or request.endpoint in RATE_LIMIT_EXEMPT:
+        return None
+    cost = ROUTE_COSTS.get(request.endpoint, 1)
+    allowed, tokens = rate_limiter.take(f"{_rate_limit_client()}|{request.endpoint}", cost, time.time())
+    g.rate_limit_tokens = tokens
+    if allowed:
+        return None
+    response = jsonify({"status": "error", "message": "Rate limit exceeded"})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(math.ceil((cost - tokens) / RATE_LIMIT_REFILL_PER_SECOND))
+    return response
+
+@app.after_request
+def add_rate_limit_headers(response):
+    tokens = g.get('rate_limit_tokens')
+    if tokens is not None:
+        response.headers['RateLimit-Limit'] = str(int(RATE_LIMIT_CAPACITY))
+        response.headers['RateLimit-Remaining'] = str(int(tokens))
+        response.headers['RateLimit-Reset'] = str(math.ceil((RATE_LIMIT_CAPACITY - tokens) / RATE_LIMIT_REFILL_PER_SECOND))
+    return response
+
+# --- Sentiment cache ---
+# TextBlob scores are cached in two tiers: a small LRU per process, then
+# (with RHYTHM_SENTIMENT_CACHE_SHM set) a table in an mmap'd file shared by
+# every worker, so a text scored by one worker is not scored again by another.
+
+SENTIMENT_CACHE_LOCAL_SIZE = int(os.environ.get('RHYTHM_SENTIMENT_CACHE_LOCAL', '1024'))
+SENTIMENT_CACHE_SHM_PATH = os.environ.get('RHYTHM_SENTIMENT_CACHE_SHM')
+SENTIMENT_CACHE_SHM_SLOTS = int(os.environ.get('RHYTHM_SENTIMENT_CACHE_SLOTS', '65536'))
+
+class SharedSentimentTable(SharedSlotFile):
+    """
+    Fixed-size open-addressing table in an mmap'd file shared by every worker.
+    Each slot holds (sequence, key hash, key check, polarity, subjectivity, last use)
+    and is found by linear probing; a full probe window reuses its least recently
+    used slot. Writers hold an exclusive fcntl lock and bump the slot's sequence to
+    odd while they write (a seqlock), so readers take no lock: they retry or give
+    up on a slot whose sequence is odd or changed under them.
+    """
+
+    SLOT = struct.Struct('<QQQddd')
+    SEQUENCE = struct.Struct('<Q')
+    LAST_USE = struct.Struct('<d')
+    LAST_USE_OFFSET = 40
+    PROBES = 8
+    READ_RETRIES = 3
+    SETTING = 'RHYTHM_SENTIMENT_CACHE_SHM'
+
+    @staticmethod
+    def _split(digest):
+        return int.from_bytes(digest[:8], 'little') or 1, int.from_bytes(digest[8:16], 'little')
+
+    def _read(self, offset):
+        """Returns a consistent copy of the slot at offset, or None if a writer keeps it busy."""
+        for _ in range(self.READ_RETRIES):
+            slot = self.SLOT.unpack_from(self._map, offset)
+            if not slot[0] & 1 and self.SEQUENCE.unpack_from(self._map, offset)[0] == slot[0]:
+                return slot
+        return None
+
+    def get(self, digest, now):
+        key_hash, check = self._split(digest)
+        start = key_hash % self.slots
+        for probe in range(self.PROBES):
+            offset = (start + probe) % self.slots * self.SLOT.size
+            slot = self._read(offset)
+            if slot is None:
+                return None
+            _, slot_hash, slot_check, polarity, subjectivity, last_use = slot
+            if slot_hash == 0:
+                return None  # slots are never emptied, so the key is not further along
+            if slot_hash == key_hash and slot_check == check:
+                if now - last_use >= 1.0:
+                    # Unlocked and approximate: only steers eviction.
+                    self.LAST_USE.pack_into(self._map, offset + self.LAST_USE_OFFSET, now)
+                return polarity, subjectivity
+        return None
+
+    def put(self, digest, polarity, subjectivity, now):
+        key_hash, check = self._split(digest)
+        start = key_hash % self.slots
+        with self._exclusive():
+            target = oldest = None
+            for probe in range(self.PROBES):
+                offset = (start + probe) % self.slots * self.SLOT.size
+                _, slot_hash, slot_check, _, _, last_use = self.SLOT.unpack_from(self._map, offset)
+                if slot_hash == 0 or (slot_hash == key_hash and slot_check == check):
+                    target = offset
+                    break
+                if oldest is None or last_use < oldest[1]:
+                    oldest = (offset, last_use)
+            if target is None:
+                target = oldest[0]
+
+            sequence = self.SEQUENCE.unpack_from(self._map, target)[0]
+            self.SEQUENCE.pack_into(self._map, target, sequence + 1)
+            self.SLOT.pack_into(self._map, target, sequence + 1, key_hash, check, polarity, subjectivity, now)
+            self.SEQUENCE.pack_into(self._map, target, sequence + 2)
+
+class SentimentCache:
+    """Per-process LRU in front of the optional shared table, with hit/miss counts per tier."""
+
+    def __init__(self, local_size, shared=None):
+        self.local_size = local_size
+        self.local = collections.OrderedDict()
+        self.shared = shared
+        self.lock = threading.Lock()
+        self.stats = {"local": {"hits": 0, "misses": 0}, "shared": {"hits": 0, "misses": 0}}
+
+    def get(self, digest):
+        with self.lock:
+            scores = self.local.get(digest)
+            if scores is not None:
+                self.local.move_to_end(digest)
+                self.stats["local"]["hits"] += 1
+                return scores
+            self.stats["local"]["misses"] += 1
+        if not self.shared:
+            return None
+        scores = self.shared.get(digest, time.time())
+        with self.lock:
+            self.stats["shared"]["hits" if scores else "misses"] += 1
+        if scores:
+            self._remember(digest, scores)
+        return scores
+
+    def put(self, digest, scores):
+        self._remember(digest, scores)
+        if self.shared:
+            self.shared.put(digest, *scores, time.time())
+
+    def _remember(self, digest, scores):
+        if not self.local_size:
+            return
+        with self.lock:
+            self.local[digest] = scores
+            self.local.move_to_end(digest)
+            if len(self.local) > self.local_size:
+                self.local.popitem(last=False)
+
+    def report(self):
+        with self.lock:
+            tiers = {tier: dict(counts) for tier, counts in self.stats.items()}
+            tiers["local"].update(size=len(self.local), capacity=self.local_size)
+        tiers["shared"]["capacity"] = self.shared.slots if self.shared else 0
+        for counts in tiers.values():
+            lookups = counts["hits"] + counts["misses"]
+            counts["hit_rate"] = round(counts["hits"] / lookups, 4) if lookups else None
+        return tiers
+
+sentiment_cache = SentimentCache(
+    SENTIMENT_CACHE_LOCAL_SIZE,
+    SharedSentimentTable(SENTIMENT_CACHE_SHM_PATH, SENTIMENT_CACHE_SHM_SLOTS) if SENTIMENT_CACHE_SHM_PATH else None
+)
 
 # --- API Endpoints ---
 
 @app.route('/')
 def index():
     """Serves the main HTML file for the application."""
+    if app.secret_key and 'user_id' not in session:
+        session['user_id'] = uuid.uuid4().hex
     return render_template_string(HTML_TEMPLATE)
 
+@app.route('/sw.js')
+def service_worker():
+    """Serves the service worker that caches the app shell for offline use."""
+    response = app.response_class(SERVICE_WORKER_JS, mimetype='application/javascript')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 @app.route('/api/tasks', methods=['GET'])
 def get_tasks():
-    """Simulates fetching tasks from integrated services."""
-    return jsonify({"tasks": mock_tasks})
+    """Simulates fetching the caller's tasks from integrated services."""
+    return jsonify({"tasks": _tenant(create=False)[1].tasks})
+
+def _validate_task(data):
+    """
+    Normalises task fields from a request payload.
+    Returns (fields, None) on success or (None, error message) on failure.
+    """
+    for field in ('title', 'source', 'cognitive_load'):
+        if data.get(field) is not None and not isinstance(data[field], str):
+            return None, f"{field} must be a string"
 
-@app.route('/api/tasks', methods=['POST'])
-def add_task():
-    """Adds a new task to the in-memory list."""
-    data = request.json or {}
     title = (data.get('title') or '').strip()
     source = (data.get('source') or '').strip() or 'Me'
     cognitive_load = (data.get('cognitive_load') or '').strip().capitalize() or 'Medium'
 
     if not title:
-        return jsonify({"status": "error", "message": "Title is required"}), 400
+        return None, "Title is required"
 
     if cognitive_load not in {"High", "Medium", "Low"}:
-        return jsonify({"status": "error", "message": "cognitive_load must be High, Medium, or Low"}), 400
+        return None, "cognitive_load must be High, Medium, or Low"
 
-    next_id = (max([t["id"] for t in mock_tasks]) + 1) if mock_tasks else 1
-    new_task = {"id": next_id, "title": title, "source": source, "cognitive_load": cognitive_load}
-    mock_tasks.append(new_task)
+    return {"title": title, "source": source, "cognitive_load": cognitive_load}, None
+
+@app.route('/api/tasks', methods=['POST'])
+def add_task():
+    """Adds a new task to the in-memory list."""
+    data = request.json or {}
+    fields, error = _validate_task(data)
+    if error:
+        return jsonify({"status": "error", "message": error}), 400
+
+    shard, tenant = _tenant()
+    with _span('store.write', op='task.put'), shard.lock:
+        _check_quota(tenant, tasks=1)
+        next_id = (max([t["id"] for t in tenant.tasks]) + 1) if tenant.tasks else 1
+        new_task = {"id": next_id, **fields}
+        tenant.tasks.append(new_task)
+        tenant.task_queue.put(new_task)
+        seq = _persist('task.put', user=tenant.name, task=new_task)
+    _wait_durable(seq)
     return jsonify({"status": "success", "task": new_task}), 201
 
 @app.route('/api/tasks/<int:task_id>', methods=['DELETE'])
 def delete_task(task_id: int):
     """Deletes a task by id from the in-memory list."""
-    global mock_tasks
-    existing_ids = {t["id"] for t in mock_tasks}
-    if task_id not in existing_ids:
-        return jsonify({"status": "error", "message": "Task not found"}), 404
-    mock_tasks = [t for t in mock_tasks if t["id"] != task_id]
+    shard, tenant = _tenant(create=False)
+    with _span('store.write', op='task.delete'), shard.lock:
+        existing_ids = {t["id"] for t in tenant.tasks}
+        if task_id not in existing_ids:
+            return jsonify({"status": "error", "message": "Task not found"}), 404
+        tenant.tasks = [t for t in tenant.tasks if t["id"] != task_id]
+        tenant.task_queue.discard(task_id)
+        seq = _persist('task.delete', user=tenant.name, id=task_id)
+    _wait_durable(seq)
     return jsonify({"status": "success", "deleted_id": task_id}), 200
 
+# Upper bound on operations accepted by a single bulk request.
+MAX_BULK_OPERATIONS = 10000
+
+@app.route('/api/tasks/bulk', methods=['POST'])
+def bulk_tasks():
+    """
+    Applies a batch of create/update/delete operations atomically.
+    Body: {"operations": [{"op": "create", title, source, cognitive_load},
+                          {"op": "update", "id", ...fields}, {"op": "delete", "id"}]}
+    Either every operation is applied or none is; the response lists a result per item.
+    An operation may carry the "idempotency_key" of the request it replays; one
+    whose key was already applied is reported as a duplicate and skipped.
+    """
+    data = request.json or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"status": "error", "message": "operations must be a non-empty list"}), 400
+    if len(operations) > MAX_BULK_OPERATIONS:
+        return jsonify({"status": "error", "message": f"At most {MAX_BULK_OPERATIONS} operations per request"}), 413
+
+    operations = [operation if isinstance(operation, dict) else {} for operation in operations]
+    # Resolved first: creating the tenant can fail, and must not strand claimed keys.
+    shard, tenant = _tenant()
+    fresh, claimed = _claim_item_keys([operation.get('idempotency_key') for operation in operations])
+    committed = False
+    try:
+        with _span('store.write', op='tasks.bulk', operations=len(operations)), shard.lock:
+            # One id index and one id allocation pass for the whole batch.
+            working = {t["id"]: t for t in tenant.tasks}
+            next_id = max(working, default=0) + 1
+            results = []
+            failed = False
+
+            for index, operation in enumerate(operations):
+                op = operation.get('op')
+                task_id = operation.get('id')
+                error = None
+
+                if 'idempotency_key' in operation and not _valid_idempotency_key(operation['idempotency_key']):
+                    error = f"idempotency_key must be 1-{IDEMPOTENCY_KEY_MAX_LENGTH} characters"
+                elif not fresh[index]:
+                    results.append({"index": index, "status": "duplicate"})
+                elif op == 'create':
+                    fields, error = _validate_task(operation)
+                    if not error:
+                        task = {"id": next_id, **fields}
+                        working[next_id] = task
+                        next_id += 1
+                        results.append({"index": index, "status": "created", "task": task})
+                elif op in {'update', 'delete'}:
+                    if not isinstance(task_id, int) or isinstance(task_id, bool):
+                        error = "id must be an integer"
+                    elif task_id not in working:
+                        error = "Task not found"
+                    elif op == 'delete':
+                        del working[task_id]
+                        results.append({"index": index, "status": "deleted", "id": task_id})
+                    else:
+                        fields, error = _validate_task({**working[task_id], **operation})
+                        if not error:
+                            task = {"id": task_id, **fields}
+                            working[task_id] = task
+                            results.append({"index": index, "status": "updated", "task": task})
+                else:
+                    error = "op must be create, update, or delete"
+
+                if error:
+                    failed = True
+                    results.append({"index": index, "status": "error", "message": error})
+
+            if failed:
+                results = [r if r["status"] == "error" else {"index": r["index"], "status": "skipped"} for r in results]
+                return jsonify({"status": "error", "message": "No operations were applied", "results": results}), 400
+
+            _check_quota(tenant, tasks=len(working) - len(tenant.tasks))
+            original = {t["id"]: t for t in tenant.tasks}
+            deletes = [task_id for task_id in original if task_id not in working]
+            puts = [task for task_id, task in working.items() if original.get(task_id) is not task]
+            tenant.tasks = list(working.values())
+            for task_id in deletes:
+                tenant.task_queue.discard(task_id)
+            for task in puts:
+                tenant.task_queue.put(task)
+            # One record, so recovery applies the whole batch or none of it.
+            seq = _persist('tasks.bulk', user=tenant.name, deletes=deletes, puts=puts)
+            committed = True
+    finally:
+        _settle_item_keys(claimed, applied=committed)
+    _wait_durable(seq)
+
+    return jsonify({"status": "success", "results": results}), 200
+
+# How well each cognitive load suits the current energy level, before adjustments.
+ENERGY_LEVELS = {"Low": 0, "Medium": 1, "High": 2}
+# Time-of-day nudges: demanding work early, lighter work late.
+TIME_PERIOD_WEIGHTS = {
+    'morning': {"High": 0.5, "Medium": 0.0, "Low": 0.0},
+    'afternoon': {"High": 0.0, "Medium": 0.5, "Low": 0.0},
+    'evening': {"High": -0.5, "Medium": 0.0, "Low": 0.5}
+}
+# Work Flow Blocks finished within this window count towards fatigue.
+FATIGUE_WINDOW = datetime.timedelta(hours=3)
+FATIGUE_PER_BLOCK = {"High": 0.5, "Medium": 0.25, "Low": 0.0}
+MAX_FATIGUE = 2.0
+MAX_NEXT_TASKS = 50
+FLOW_BLOCK_RE = re.compile(r'\((work|break|long-break) mode, (\w+) energy\)')
+
+def _recent_fatigue(tenant, now):
+    """Sums the fatigue of the tenant's recent work Flow Blocks (call with its shard lock held)."""
+    blocks, _ = tenant.activities.query('flow_block', date_from=(now - FATIGUE_WINDOW).isoformat(), limit=math.inf)
+    fatigue = 0.0
+    for entry in blocks:
+        mode, energy = entry.get('mode'), entry.get('energy')
+        if mode is None or energy is None:
+            # Blocks logged by the client only carry the text form.
+            match = FLOW_BLOCK_RE.search(entry['activity'])
+            if match:
+                mode, energy = mode or match.group(1), energy or match.group(2)
+        if mode == 'work':
+            fatigue += FATIGUE_PER_BLOCK.get(energy, 0.0)
+    return min(fatigue, MAX_FATIGUE)
+
+def _load_weights(energy, time_period, fatigue):
+    """Scores each cognitive load for the caller's energy, the time of day and recent fatigue."""
+    weights = {}
+    for load in TASK_LOADS:
+        weight = 3 - abs(ENERGY_LEVELS[energy] - ENERGY_LEVELS[load]) + TIME_PERIOD_WEIGHTS[time_period][load]
+        if load == 'High':
+            weight -= fatigue
+        elif load == 'Medium':
+            weight -= fatigue / 2
+        weights[load] = round(weight, 2)
+    return weights
+
+@app.route('/api/tasks/next', methods=['GET'])
+def get_next_tasks():
+    """
+    Suggests the caller's next tasks for their energy level (High|Medium|Low).
+    Loads are weighted by how well they fit that energy, the time of day and the
+    fatigue from recent work Flow Blocks; ties go to the oldest task.
+    Query: energy (default Medium), k (default 3).
+    """
+    energy = (request.args.get('energy') or 'Medium').strip().capitalize()
+    if energy not in ENERGY_LEVELS:
+        return jsonify({"status": "error", "message": "energy must be High, Medium, or Low"}), 400
+    try:
+        k = min(max(int(request.args.get('k', 3)), 1), MAX_NEXT_TASKS)
+    except ValueError:
+        return jsonify({"status": "error", "message": "k must be an integer"}), 400
+
+    now = datetime.datetime.now()
+    time_period = _time_period(now.hour)
+    shard, tenant = _tenant(create=False)
+    with _span('store.read', index='task_queue'), shard.lock:
+        fatigue = _recent_fatigue(tenant, now)
+        weights = _load_weights(energy, time_period, fatigue)
+        tasks = tenant.task_queue.top(weights, k)
+    return jsonify({
+        "energy": energy,
+        "time_period": time_period,
+        "fatigue": fatigue,
+        "weights": weights,
+        "tasks": tasks
+    })
+
 @app.route('/api/log_activity', methods=['POST'])
 def log_activity():
     """Logs user activities for the daily synthesis."""
-    activity = request.json.get('activity')
-    if activity:
-        timestamp = datetime.datetime.now().isoformat()
-        user_activity_log.append({"timestamp": timestamp, "activity": activity})
-        return jsonify({"status": "success", "logged": activity}), 200
-    return jsonify({"status": "error", "message": "No activity provided"}), 400
+    activity = (request.json or {}).get('activity')
+    if not isinstance(activity, str) or not activity.strip():
+        return jsonify({"status": "error", "message": "activity must be a non-empty string"}), 400
+    _log_event(activity)
+    return jsonify({"status": "success", "logged": activity}), 200
+
+def _score_sentiment(text):
+    """Returns TextBlob polarity and subjectivity rounded to two decimals (cached by text)."""
+    digest = hashlib.blake2b(text.encode(), digest_size=16).digest()
+    scores = sentiment_cache.get(digest)
+    if scores is None:
+        with _span('textblob.sentiment', chars=len(text)):
+            sentiment = TextBlob(text).sentiment
+        scores = (round(sentiment.polarity, 2), round(sentiment.subjectivity, 2))
+        sentiment_cache.put(digest, scores)
+    return {"polarity": scores[0], "subjectivity": scores[1]}
+
+ACTIVITY_QUERY_MAX_LIMIT = 1000
+
+def _encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+def _decode_cursor(cursor):
+    timestamp, arrival = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(timestamp, str) or not isinstance(arrival, int):
+        raise ValueError("Invalid cursor")
+    return timestamp, arrival
+
+@app.route('/api/activities', methods=['GET'])
+def get_activities():
+    """
+    Reads back the caller's activity log in timestamp order.
+    Query: from, to (ISO dates/datetimes), kind (flow_block|journal|breathing|other),
+    limit, cursor (from the previous page's next_cursor).
+    """
+    args = request.args
+    kind = args.get('kind') or 'all'
+    if kind != 'all' and kind not in ACTIVITY_KINDS:
+        return jsonify({"status": "error", "message": f"kind must be one of {', '.join(ACTIVITY_KINDS)}"}), 400
+    try:
+        date_from = _parse_bound(args.get('from'))
+        date_to = _parse_bound(args.get('to'), end_of_day=True)
+        limit = min(max(int(args.get('limit', 100)), 1), ACTIVITY_QUERY_MAX_LIMIT)
+        after = _decode_cursor(args['cursor']) if args.get('cursor') else None
+    except (ValueError, TypeError, binascii.Error):
+        return jsonify({"status": "error", "message": "Invalid date, limit, or cursor"}), 400
+
+    shard, tenant = _tenant(create=False)
+    with _span('store.read', index='activities'), shard.lock:
+        entries, next_key = tenant.activities.query(kind, date_from, date_to, after, limit)
+    return jsonify({
+        "activities": entries,
+        "next_cursor": _encode_cursor(next_key) if next_key else None
+    })
 
 @app.route('/api/sentiment', methods=['POST'])
 def analyze_sentiment():
     """
     Analyzes the sentiment of a given text using TextBlob.
-    Returns polarity and subjectivity.
+    Returns polarity and subjectivity. Nothing is logged: saving the entry
+    through /api/journal records the journal activity.
     """
-    text_to_analyze = request.json.get('text', '')
-    if not text_to_analyze:
+    text_to_analyze = (request.json or {}).get('text', '')
+    if not isinstance(text_to_analyze, str) or not text_to_analyze:
         return jsonify({"error": "No text provided"}), 400
 
-    blob = TextBlob(text_to_analyze)
-    sentiment = {
-        "polarity": round(blob.sentiment.polarity, 2),
-        "subjectivity": round(blob.sentiment.subjectivity, 2)
-    }
-    
-    # Log this activity
-    timestamp = datetime.datetime.now().isoformat()
-    user_activity_log.append({"timestamp": timestamp, "activity": f"Wrote a journal entry with polarity: {sentiment['polarity']}"})
+    return jsonify(_score_sentiment(text_to_analyze))
 
-    return jsonify(sentiment)
+@app.route('/api/sentiment/cache', methods=['GET'])
+def sentiment_cache_stats():
+    """Reports this worker's sentiment cache hits, misses and hit rate per tier."""
+    return jsonify({"worker": os.getpid(), "tiers": sentiment_cache.report()})
 
-@app.route('/api/breathing_exercise', methods=['POST'])
-def start_breathing_exercise():
-    """Starts a guided breathing exercise."""
-    exercise_type = request.json.get('type', '4-7-8')
-    
-    exercises = {
+# --- Mindfulness content ---
+
+# Built-in catalog; RHYTHM_CONTENT_FILE may point at a JSON file with the same
+# shape ({"exercises": {...}, "tips": {...}}) whose keys override these.
+DEFAULT_CONTENT = {
+    "exercises": {
         '4-7-8': {
             'name': '4-7-8 Breathing',
             'description': 'Inhale for 4, hold for 7, exhale for 8',
@@ -121,25 +1384,8 @@ def start_breathing_exercise():
                 "Repeat 6 times"
             ]
         }
-    }
-    
-    exercise = exercises.get(exercise_type, exercises['4-7-8'])
-    
-    # Log this mindfulness activity
-    timestamp = datetime.datetime.now().isoformat()
-    user_activity_log.append({
-        "timestamp": timestamp, 
-        "activity": f"Completed {exercise['name']} breathing exercise"
-    })
-    
-    return jsonify(exercise)
-
-@app.route('/api/mindfulness_tip', methods=['GET'])
-def get_mindfulness_tip():
-    """Returns a personalized mindfulness tip based on time of day and recent activity."""
-    current_hour = datetime.datetime.now().hour
-    
-    tips = {
+    },
+    "tips": {
         'morning': [
             "Start your day with gratitude. Write down three things you're grateful for.",
             "Take 5 deep breaths before checking your phone or email.",
@@ -159,83 +1405,1224 @@ def get_mindfulness_tip():
             "Do a gentle stretching routine to release tension."
         ]
     }
-    
-    if current_hour < 12:
-        time_period = 'morning'
-    elif current_hour < 18:
-        time_period = 'afternoon'
-    else:
-        time_period = 'evening'
-    
-    import random
-    tip = random.choice(tips[time_period])
-    
-    return jsonify({
-        "tip": tip,
-        "time_period": time_period,
-        "timestamp": datetime.datetime.now().isoformat()
-    })
+}
 
-@app.route('/api/synthesis', methods=['POST'])
-def generate_synthesis():
-    activities = request.json.get('activities', [])
+CONTENT_FILE = os.environ.get('RHYTHM_CONTENT_FILE')
+# Minimum seconds between checks of the content file's modification time.
+CONTENT_RELOAD_INTERVAL = 1.0
+
+class ContentCatalog:
+    """
+    Breathing exercises and mindfulness tips, encoded once when loaded.
+    Each exercise keeps its JSON bytes; each tip bucket keeps the bytes of every
+    tip response up to the timestamp, plus a bucket ETag. The optional content
+    file is re-read when its modification time changes.
+    """
 
-    if not activities:
-        return jsonify({"summary": "No activity was logged today. Start a Flow Block, try a breathing exercise, or write a journal entry to see your synthesis."})
+    def __init__(self, path=None):
+        self.path = path
+        self._mtime = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        self._install(DEFAULT_CONTENT)
+        self.refresh()
+
+    def _install(self, content):
+        exercises = {}
+        for key, exercise in content['exercises'].items():
+            body = json.dumps(exercise).encode()
+            exercises[key] = {"name": exercise['name'], "body": body}
+
+        tips = {}
+        for period, entries in content['tips'].items():
+            if not isinstance(entries, list) or not entries or not all(isinstance(tip, str) for tip in entries):
+                raise ValueError(f"Tips for {period!r} must be a non-empty list of strings")
+            prefix = b', "time_period": ' + json.dumps(period).encode() + b', "timestamp": "'
+            tips[period] = {
+                "tips": [b'{"tip": ' + json.dumps(tip).encode() + prefix for tip in entries],
+                "etag": hashlib.sha1(json.dumps(entries).encode()).hexdigest()
+            }
+        # Swapped in one assignment so readers never see a half-built catalog.
+        self._content = (exercises, tips)
+
+    def refresh(self):
+        """Reloads the content file if it changed (checked at most once per interval)."""
+        now = time.monotonic()
+        if not self.path or now < self._next_check:
+            return
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + CONTENT_RELOAD_INTERVAL
+            try:
+                mtime = os.stat(self.path).st_mtime
+                if mtime == self._mtime:
+                    return
+                with open(self.path, encoding='utf-8') as f:
+                    overrides = json.load(f)
+                self._install({
+                    "exercises": {**DEFAULT_CONTENT['exercises'], **overrides.get('exercises', {})},
+                    "tips": {**DEFAULT_CONTENT['tips'], **overrides.get('tips', {})}
+                })
+                self._mtime = mtime
+            except (OSError, ValueError, KeyError, TypeError):
+                app.logger.exception("Could not load content file %s; keeping current catalog", self.path)
 
-    flow_blocks = [a for a in activities if "Flow Block" in a['activity']]
-    journal_entries = [a for a in activities if "journal entry" in a['activity']]
-    breathing_exercises = [a for a in activities if "breathing exercise" in a['activity']]
+    def exercise(self, exercise_type):
+        self.refresh()
+        exercises = self._content[0]
+        return exercises.get(exercise_type) or exercises['4-7-8']
 
-    high_energy_tasks = sum(1 for a in flow_blocks if "High" in a['activity'])
-    medium_energy_tasks = sum(1 for a in flow_blocks if "Medium" in a['activity'])
-    low_energy_tasks = sum(1 for a in flow_blocks if "Low" in a['activity'])
+    def tip_bucket(self, time_period):
+        self.refresh()
+        return self._content[1][time_period]
 
-    summary_parts = []
-    summary_parts.append("Here is your synthesis for today:")
+content_catalog = ContentCatalog(CONTENT_FILE)
 
-    if flow_blocks:
-        total_tasks = len(flow_blocks)
-        summary_parts.append(f"\n\n- *Productivity*: You powered through {total_tasks} focus session{'s' if total_tasks > 1 else ''}. This included {high_energy_tasks} high-energy, {medium_energy_tasks} medium-energy, and {low_energy_tasks} low-energy tasks. Your dedication to deep work is clear.")
+@app.route('/api/breathing_exercise', methods=['POST'])
+def start_breathing_exercise():
+    """Starts a guided breathing exercise."""
+    exercise_type = request.json.get('type', '4-7-8')
+    exercise = content_catalog.exercise(exercise_type)
     
-    if breathing_exercises:
-        summary_parts.append(f"\n- *Mindfulness*: Great job taking care of your mental well-being! You completed {len(breathing_exercises)} breathing exercise{'s' if len(breathing_exercises) > 1 else ''} today. This shows you're prioritizing both productivity and peace of mind.")
+    # Log this mindfulness activity
+    _log_event(f"Completed {exercise['name']} breathing exercise")
+    
+    return app.response_class(exercise['body'], mimetype='application/json')
+
+def _time_period(hour):
+    """Buckets an hour of the day into morning, afternoon or evening."""
+    if hour < 12:
+        return 'morning'
+    if hour < 18:
+        return 'afternoon'
+    return 'evening'
+
+@app.route('/api/mindfulness_tip', methods=['GET'])
+def get_mindfulness_tip():
+    """Returns a personalized mindfulness tip based on time of day and recent activity."""
+    time_period = _time_period(datetime.datetime.now().hour)
+    bucket = content_catalog.tip_bucket(time_period)
+    body = random.choice(bucket['tips']) + datetime.datetime.now().isoformat().encode() + b'"}'
     
-    if journal_entries:
-        # Extract polarities from journal entries that have sentiment data
-        polarities = []
-        for entry in journal_entries:
-            if 'polarity:' in entry['activity']:
+    response = app.response_class(body, mimetype='application/json')
+    # Weak: any tip from the same bucket is an equivalent answer.
+    response.set_etag(bucket['etag'], weak=True)
+    return response.make_conditional(request)
+
+class SynthesisStats:
+    """Counters behind the daily synthesis, accumulated one activity at a time."""
+
+    def __init__(self):
+        self.total = 0
+        self.flow_blocks = 0
+        self.high_energy_tasks = 0
+        self.medium_energy_tasks = 0
+        self.low_energy_tasks = 0
+        self.breathing_exercises = 0
+        self.journal_entries = 0
+        self.polarity_sum = 0.0
+        self.polarity_count = 0
+
+    def add(self, activity):
+        self.total += 1
+        if "Flow Block" in activity:
+            self.flow_blocks += 1
+            self.high_energy_tasks += "High" in activity
+            self.medium_energy_tasks += "Medium" in activity
+            self.low_energy_tasks += "Low" in activity
+        if "breathing exercise" in activity:
+            self.breathing_exercises += 1
+        if "journal entry" in activity:
+            self.journal_entries += 1
+            # Extract polarity value from entries like "Wrote a journal entry with polarity: 0.5"
+            if 'polarity:' in activity:
                 try:
-                    # Extract polarity value from entries like "Wrote a journal entry with polarity: 0.5"
-                    polarity_str = entry['activity'].split('polarity: ')[-1]
-                    polarities.append(float(polarity_str))
-                except (ValueError, IndexError):
-                    continue
+                    self.polarity_sum += float(activity.split('polarity: ')[-1])
+                    self.polarity_count += 1
+                except ValueError:
+                    pass
+
+    def render(self):
+        """Renders the daily synthesis text."""
+        if not self.total:
+            return "No activity was logged today. Start a Flow Block, try a breathing exercise, or write a journal entry to see your synthesis."
+
+        high_energy_tasks = self.high_energy_tasks
+        breathing_exercises = self.breathing_exercises
+
+        summary_parts = []
+        summary_parts.append("Here is your synthesis for today:")
+
+        if self.flow_blocks:
+            total_tasks = self.flow_blocks
+            summary_parts.append(f"\n\n- *Productivity*: You powered through {total_tasks} focus session{'s' if total_tasks > 1 else ''}. This included {high_energy_tasks} high-energy, {self.medium_energy_tasks} medium-energy, and {self.low_energy_tasks} low-energy tasks. Your dedication to deep work is clear.")
         
-        avg_polarity = sum(polarities) / len(polarities) if polarities else 0
+        if breathing_exercises:
+            summary_parts.append(f"\n- *Mindfulness*: Great job taking care of your mental well-being! You completed {breathing_exercises} breathing exercise{'s' if breathing_exercises > 1 else ''} today. This shows you're prioritizing both productivity and peace of mind.")
         
-        sentiment_adjective = "positive"
-        if avg_polarity < -0.1:
-            sentiment_adjective = "challenging"
-        elif avg_polarity <= 0.1:
-            sentiment_adjective = "neutral"
+        if self.journal_entries:
+            avg_polarity = self.polarity_sum / self.polarity_count if self.polarity_count else 0
             
-        summary_parts.append(f"\n- *Well-being*: You took time for reflection. Your journal entries indicate a generally {sentiment_adjective} mindset today (average sentiment: {avg_polarity:.2f}).")
-
-    # Enhanced AI recommendations based on activity patterns
-    if high_energy_tasks > 2 and len(breathing_exercises) == 0:
-        recommendation = "You tackled some major tasks today! Consider adding a breathing exercise to your routine to help manage stress and maintain balance."
-    elif len(breathing_exercises) > 0 and high_energy_tasks == 0:
-        recommendation = "You focused on mindfulness today. Tomorrow might be a great time to tackle a high-energy task while maintaining your calm mindset."
-    elif high_energy_tasks > 2 and len(breathing_exercises) > 0:
-        recommendation = "Excellent balance! You're successfully combining productivity with mindfulness. Keep up this integrated approach."
+            sentiment_adjective = "positive"
+            if avg_polarity < -0.1:
+                sentiment_adjective = "challenging"
+            elif avg_polarity <= 0.1:
+                sentiment_adjective = "neutral"
+                
+            summary_parts.append(f"\n- *Well-being*: You took time for reflection. Your journal entries indicate a generally {sentiment_adjective} mindset today (average sentiment: {avg_polarity:.2f}).")
+
+        # Enhanced AI recommendations based on activity patterns
+        if high_energy_tasks > 2 and breathing_exercises == 0:
+            recommendation = "You tackled some major tasks today! Consider adding a breathing exercise to your routine to help manage stress and maintain balance."
+        elif breathing_exercises > 0 and high_energy_tasks == 0:
+            recommendation = "You focused on mindfulness today. Tomorrow might be a great time to tackle a high-energy task while maintaining your calm mindset."
+        elif high_energy_tasks > 2 and breathing_exercises > 0:
+            recommendation = "Excellent balance! You're successfully combining productivity with mindfulness. Keep up this integrated approach."
+        else:
+            recommendation = "It was a balanced day. Tomorrow looks like a great opportunity to tackle a high-energy task in the morning when your focus is at its peak."
+            
+        summary_parts.append(f"\n\n- *Recommendation*: {recommendation}")
+
+        return "".join(summary_parts)
+
+def _build_synthesis(activities):
+    """Renders the daily synthesis text for a list of activity entries."""
+    stats = SynthesisStats()
+    for entry in activities:
+        stats.add(entry['activity'])
+    return stats.render()
+
+# Limits for client-supplied synthesis payloads (POST /api/synthesis).
+SYNTHESIS_MAX_BYTES = int(os.environ.get('RHYTHM_SYNTHESIS_MAX_BYTES', str(2 * 1024 * 1024)))
+SYNTHESIS_MAX_ITEMS = int(os.environ.get('RHYTHM_SYNTHESIS_MAX_ITEMS', '20000'))
+STREAM_READ_SIZE = 64 * 1024
+
+class PayloadTooLarge(Exception):
+    """Raised while streaming a request body that exceeds its byte limit."""
+
+# What is left of the buffer after a number that might continue in the next read.
+_JSON_NUMBER_TAIL = re.compile(r'[0-9.eE+-]*\Z')
+
+def _iter_json_array(stream, key, max_bytes):
+    """
+    Yields the items of the array under `key` in a JSON object body, decoding
+    them as the bytes arrive. Raises ValueError for malformed JSON and
+    PayloadTooLarge once more than max_bytes have been read.
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    received = 0
+    buffer = ''
+    eof = False
+
+    def fill():
+        nonlocal buffer, received, eof
+        chunk = stream.read(STREAM_READ_SIZE)
+        received += len(chunk)
+        if received > max_bytes:
+            raise PayloadTooLarge()
+        eof = not chunk
+        buffer += text_decoder.decode(chunk, final=eof)
+
+    header = re.compile(r'\s*\{\s*' + re.escape(json.dumps(key)) + r'\s*:\s*\[')
+    while True:
+        fill()
+        match = header.match(buffer)
+        if match or eof or len(buffer) > 256:
+            break
+
+    if not match:
+        # Another key comes first: fall back to parsing the (size-limited) body whole.
+        while not eof:
+            fill()
+        body = json.loads(buffer or 'null')
+        if not isinstance(body, dict) or not isinstance(body.get(key, []), list):
+            raise ValueError(f"Expected an object with a '{key}' array")
+        yield from body.get(key, [])
+        return
+
+    buffer = buffer[match.end():]
+    pos = 0
+    count = 0
+    expect_item = True  # False once an item was read and a ',' or ']' must follow
+    while True:
+        while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+            pos += 1
+        if pos >= len(buffer):
+            if eof:
+                raise ValueError("Unterminated array")
+            buffer, pos = buffer[pos:], 0
+            fill()
+            continue
+        char = buffer[pos]
+        if char == ']' and (not expect_item or not count):
+            break
+        if not expect_item:
+            if char != ',':
+                raise ValueError("Expected ',' or ']' between array items")
+            pos += 1
+            expect_item = True
+            continue
+        if char in ',]':
+            raise ValueError("Expected an array item")
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise ValueError("Malformed JSON")
+            buffer, pos = buffer[pos:], 0
+            fill()
+            continue
+        if not eof and _JSON_NUMBER_TAIL.match(buffer, end) and isinstance(item, (int, float)) and not isinstance(item, bool):
+            # A number that may run on past the read ("2." + "5") would decode short; read on first.
+            buffer, pos = buffer[pos:], 0
+            fill()
+            continue
+        yield item
+        count += 1
+        pos = end
+        expect_item = False
+
+    # The rest of the body must close the object (other keys may follow the array).
+    buffer = buffer[pos + 1:]
+    while not eof:
+        fill()
+    try:
+        json.loads('{"": 0' + buffer)
+    except ValueError:
+        raise ValueError("Malformed JSON after the array")
+
+@app.route('/api/synthesis', methods=['GET'])
+def get_synthesis():
+    """
+    Summarises today's logged activity for the current user.
+    The rendered summary is cached per user and day until a new event is logged,
+    and served with an ETag so clients can revalidate with If-None-Match.
+    """
+    shard, tenant = _tenant(create=False)
+    day = datetime.date.today().isoformat()
+    version = tenant.version
+
+    cached = tenant.synthesis
+    if not cached or cached['day'] != day or cached['version'] != version:
+        with _span('store.read', index='activities'), shard.lock:
+            activities, _ = tenant.activities.query(date_from=day, date_to=day + 'T23:59:59.999999', limit=math.inf)
+        summary = _build_synthesis(activities)
+        cached = {
+            "day": day,
+            "version": version,
+            # Derived from the content: versions restart at 0 with every process.
+            "etag": "synthesis-" + hashlib.blake2b(summary.encode(), digest_size=12).hexdigest(),
+            "summary": summary
+        }
+        tenant.synthesis = cached
+
+    if request.if_none_match.contains_weak(cached['etag']):
+        response = app.response_class(status=304)
     else:
-        recommendation = "It was a balanced day. Tomorrow looks like a great opportunity to tackle a high-energy task in the morning when your focus is at its peak."
-        
-    summary_parts.append(f"\n\n- *Recommendation*: {recommendation}")
+        response = jsonify({"summary": cached['summary']})
+    response.set_etag(cached['etag'])
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
-    return jsonify({"summary": "".join(summary_parts)})
+@app.route('/api/synthesis', methods=['POST'])
+def generate_synthesis():
+    """
+    Summarises a client-supplied list of activities (not cached).
+    The body is decoded incrementally and aggregated in a single pass; bodies
+    or arrays over the configured limits are rejected with 413 as soon as seen.
+    """
+    if not request.is_json:
+        return jsonify({"status": "error", "message": "Expected a JSON body"}), 415
+    if request.content_length and request.content_length > SYNTHESIS_MAX_BYTES:
+        return jsonify({"status": "error", "message": f"Body exceeds {SYNTHESIS_MAX_BYTES} bytes"}), 413
+
+    stats = SynthesisStats()
+    try:
+        with _span('synthesis.stream_parse'):
+            for item in _iter_json_array(request.stream, 'activities', SYNTHESIS_MAX_BYTES):
+                if stats.total >= SYNTHESIS_MAX_ITEMS:
+                    return jsonify({"status": "error", "message": f"At most {SYNTHESIS_MAX_ITEMS} activities per request"}), 413
+                if not isinstance(item, dict) or not isinstance(item.get('activity'), str):
+                    return jsonify({"status": "error", "message": "Each activity must be an object with an 'activity' string"}), 400
+                stats.add(item['activity'])
+    except PayloadTooLarge:
+        return jsonify({"status": "error", "message": f"Body exceeds {SYNTHESIS_MAX_BYTES} bytes"}), 413
+    except (ValueError, UnicodeDecodeError) as e:
+        return jsonify({"status": "error", "message": f"Invalid JSON body: {e}"}), 400
+
+    return jsonify({"summary": stats.render()})
+
+# --- Journal ---
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+JOURNAL_SEARCH_MAX_LIMIT = 100
+JOURNAL_STOPWORDS = frozenset(
+    "a an and are as at be but by for from had has have i i'm in is it it's me my of on or "
+    "so that the this to was were with you".split()
+)
+_token_pattern = re.compile(r"[a-z0-9']+")
+
+def _tokenize(text):
+    return [t for t in _token_pattern.findall(text.lower()) if t not in JOURNAL_STOPWORDS]
+
+class JournalIndex:
+    """
+    One user's journal entries with an incremental inverted index.
+    Entries are appended in time order, so date ranges map to a slice found by
+    bisect; text queries score only the postings of their terms with BM25.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.timestamps = []
+        self.postings = {}  # term -> {entry position: term frequency}
+        self.lengths = []
+        self.total_length = 0
+
+    def add(self, entry):
+        position = len(self.entries)
+        tokens = _tokenize(entry['text'])
+        self.entries.append(entry)
+        self.timestamps.append(entry['created_at'])
+        self.lengths.append(len(tokens))
+        self.total_length += len(tokens)
+        for term in tokens:
+            postings = self.postings.setdefault(term, {})
+            postings[position] = postings.get(position, 0) + 1
+
+    def get(self, entry_id):
+        # Ids are 1-based positions.
+        return self.entries[entry_id - 1] if 0 < entry_id <= len(self.entries) else None
+
+    def search(self, query='', min_polarity=None, max_polarity=None, date_from=None, date_to=None, limit=20):
+        """Returns up to `limit` (score, entry) pairs, best first (newest first without a query)."""
+        lo = bisect.bisect_left(self.timestamps, date_from) if date_from else 0
+        hi = bisect.bisect_right(self.timestamps, date_to) if date_to else len(self.entries)
+
+        def accepted(position):
+            polarity = self.entries[position]['polarity']
+            return (lo <= position < hi
+                    and (min_polarity is None or polarity >= min_polarity)
+                    and (max_polarity is None or polarity <= max_polarity))
+
+        terms = set(_tokenize(query))
+        if not terms:
+            results = []
+            for position in range(hi - 1, lo - 1, -1):
+                if accepted(position):
+                    results.append((None, self.entries[position]))
+                    if len(results) >= limit:
+                        break
+            return results
+
+        count = len(self.entries)
+        filtered = lo > 0 or hi < count or min_polarity is not None or max_polarity is not None
+        # BM25 length normalisation: K1 * (1 - B + B * length / avg_length) = base + per_token * length
+        base = BM25_K1 * (1 - BM25_B)
+        per_token = BM25_K1 * BM25_B * count / self.total_length if self.total_length else 0.0
+        lengths = self.lengths
+        scores = {}
+        for term in terms:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            weight = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5)) * (BM25_K1 + 1)
+            for position, frequency in postings.items():
+                if filtered and not accepted(position):
+                    continue
+                scores[position] = scores.get(position, 0.0) + weight * frequency / (frequency + base + per_token * lengths[position])
+
+        best = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))
+        return [(round(score, 4), self.entries[position]) for position, score in best]
+
+def _parse_bound(value, end_of_day=False):
+    """Normalises an ISO date/datetime query bound; a bare date ends at midnight when end_of_day."""
+    if not value:
+        return None
+    try:
+        day = datetime.date.fromisoformat(value).isoformat()
+    except ValueError:
+        return _normalize_timestamp(value)
+    return day + 'T23:59:59.999999' if end_of_day else day
+
+@app.route('/api/journal', methods=['POST'])
+def save_journal_entry():
+    """Stores a full journal entry with its sentiment scores and indexes it for search."""
+    data = request.json or {}
+    text = data.get('text')
+    if not isinstance(text, str) or not text.strip():
+        return jsonify({"status": "error", "message": "No text provided"}), 400
+    text = text.strip()
+
+    sentiment = _score_sentiment(text)
+    shard, tenant = _tenant()
+    with _span('store.write', op='journal.add'), shard.lock:
+        _check_quota(tenant, activities=1, journal_entries=1)
+        index = tenant.journal
+        entry = {
+            "id": len(index.entries) + 1,
+            "user": tenant.name,
+            "text": text,
+            "polarity": sentiment['polarity'],
+            "subjectivity": sentiment['subjectivity'],
+            "created_at": datetime.datetime.now().isoformat()
+        }
+        index.add(entry)
+        seq = _persist('journal.add', entry=entry)
+    _wait_durable(seq)
+
+    _log_event(f"Wrote a journal entry with polarity: {sentiment['polarity']}", user=tenant.name)
+    return jsonify({"status": "success", "entry": entry}), 201
+
+@app.route('/api/journal', methods=['GET'])
+def search_journal():
+    """
+    Searches the caller's journal.
+    Query: q (BM25 full-text), min_polarity, max_polarity, from, to (ISO dates), limit.
+    Without q, matching entries are returned newest first.
+    """
+    args = request.args
+    try:
+        min_polarity = float(args['min_polarity']) if args.get('min_polarity') else None
+        max_polarity = float(args['max_polarity']) if args.get('max_polarity') else None
+        date_from = _parse_bound(args.get('from'))
+        date_to = _parse_bound(args.get('to'), end_of_day=True)
+        limit = min(max(int(args.get('limit', 20)), 1), JOURNAL_SEARCH_MAX_LIMIT)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid polarity, date, or limit"}), 400
+
+    shard, tenant = _tenant(create=False)
+    # Saves add to the index under the shard lock; searching without it can see
+    # the postings change size mid-iteration.
+    with _span('journal.search', limit=limit), shard.lock:
+        results = tenant.journal.search(args.get('q', ''), min_polarity, max_polarity, date_from, date_to, limit)
+    return jsonify({"results": [{**entry, "score": score} for score, entry in results]})
+
+@app.route('/api/journal/<int:entry_id>', methods=['GET'])
+def get_journal_entry(entry_id: int):
+    """Returns one of the caller's journal entries."""
+    shard, tenant = _tenant(create=False)
+    with shard.lock:
+        entry = tenant.journal.get(entry_id)
+    if not entry:
+        return jsonify({"status": "error", "message": "Entry not found"}), 404
+    return jsonify({"status": "success", "entry": entry})
+
+# --- Focus sessions ---
+
+class TimerWheel:
+    """
+    Hierarchical timing wheel with O(1) schedule and cancel.
+    Level 0 holds `slots` buckets of one tick each; every higher level spans `slots`
+    times the level below and cascades its buckets down as the wheel turns.
+    Callbacks run on the driver thread, outside the wheel lock.
+    """
+
+    def __init__(self, tick=1.0, slots=64, levels=4):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.horizon = slots ** levels
+        self.wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.current = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def schedule(self, delay, callback):
+        """Runs callback after `delay` seconds; returns a handle for cancel()."""
+        ticks = max(1, math.ceil(delay / self.tick))
+        if ticks >= self.horizon:
+            raise ValueError("Delay is beyond the timer wheel horizon")
+        with self._lock:
+            timer = [self.current + ticks, callback, False]
+            self._place(timer)
+        return timer
+
+    def cancel(self, timer):
+        # Cancelled timers stay in their bucket and are skipped when it fires.
+        timer[2] = True
+
+    def _place(self, timer):
+        delta = timer[0] - self.current
+        level = 0
+        while delta >= self.slots ** (level + 1):
+            level += 1
+        index = (timer[0] // self.slots ** level) % self.slots
+        self.wheels[level][index].append(timer)
+
+    def advance(self):
+        """Moves the wheel forward one tick and fires the timers that expire."""
+        with self._lock:
+            self.current += 1
+            # Cascade higher levels first so their timers land in buckets processed this tick.
+            level = 1
+            while level < self.levels and self.current % self.slots ** level == 0:
+                level += 1
+            for cascade_level in range(level - 1, 0, -1):
+                index = (self.current // self.slots ** cascade_level) % self.slots
+                bucket = self.wheels[cascade_level][index]
+                self.wheels[cascade_level][index] = []
+                for timer in bucket:
+                    if not timer[2]:
+                        self._place(timer)
+            index = self.current % self.slots
+            due = self.wheels[0][index]
+            self.wheels[0][index] = []
+
+        for timer in due:
+            if not timer[2]:
+                try:
+                    timer[1]()
+                except Exception:
+                    app.logger.exception("Timer callback failed")
+
+    def start(self):
+        """Starts the driver thread once; missed ticks are caught up after a stall."""
+        with self._lock:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._run, name='rhythm-timer-wheel', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        started = time.monotonic()
+        while True:
+            target = int((time.monotonic() - started) / self.tick)
+            while self.current < target:
+                self.advance()
+            time.sleep(max(0.0, started + (self.current + 1) * self.tick - time.monotonic()))
+
+timer_wheel = TimerWheel()
+# Focus sessions by id; the timers are the wheel handles of every session's next
+# deadline, pause expiry or removal. live_sessions holds each user's running and
+# paused session ids.
+focus_sessions = {}
+focus_session_timers = {}
+live_sessions = {}
+sessions_lock = threading.RLock()
+
+FOCUS_MODES = {'work', 'break', 'long-break'}
+MAX_FOCUS_SECONDS = 180 * 60
+# Finished sessions stay readable for this long before they are dropped.
+FINISHED_SESSION_TTL = 60 * 60
+# Paused sessions left this long are cancelled.
+PAUSED_SESSION_TTL = 12 * 60 * 60
+# Running and paused sessions one user may hold at a time.
+MAX_LIVE_SESSIONS_PER_USER = int(os.environ.get('RHYTHM_MAX_LIVE_SESSIONS', '10'))
+
+def _session_view(session):
+    view = dict(session)
+    view.pop('deadline', None)
+    if session['state'] == 'running':
+        view['remaining_seconds'] = max(0, math.ceil(session['deadline'] - time.monotonic()))
+    return view
+
+def _finish_session(session, state):
+    """Stops a session; completed sessions are logged as a Flow Block."""
+    timer = focus_session_timers.pop(session['id'], None)
+    if timer:
+        timer_wheel.cancel(timer)
+    if session['state'] == 'running':
+        session['remaining_seconds'] = max(0, math.ceil(session['deadline'] - time.monotonic()))
+    session['state'] = state
+    session['ended_at'] = datetime.datetime.now().isoformat()
+    session_id = session['id']
+    user_sessions = live_sessions.get(session['user'], set())
+    user_sessions.discard(session_id)
+    if not user_sessions:
+        live_sessions.pop(session['user'], None)
+    focus_session_timers[session_id] = timer_wheel.schedule(
+        FINISHED_SESSION_TTL, lambda: _expire_session(session_id)
+    )
+
+    if state == 'completed':
+        _log_event(
+            f"Flow Block completed: {session['task_title']} ({session['mode']} mode, {session['energy']} energy)",
+            user=session['user'],
+            kind='flow_block',
+            session_id=session_id,
+            task_id=session['task_id'],
+            mode=session['mode'],
+            energy=session['energy'],
+            duration_seconds=session['duration_seconds'] - session['remaining_seconds']
+        )
+
+def _on_session_deadline(session_id):
+    with sessions_lock:
+        session = focus_sessions.get(session_id)
+        if session and session['state'] == 'running':
+            _finish_session(session, 'completed')
+
+def _on_pause_expired(session_id):
+    with sessions_lock:
+        session = focus_sessions.get(session_id)
+        if session and session['state'] == 'paused':
+            _finish_session(session, 'cancelled')
+
+def _expire_session(session_id):
+    with sessions_lock:
+        focus_sessions.pop(session_id, None)
+        focus_session_timers.pop(session_id, None)
+
+def _run_session(session, seconds):
+    session['state'] = 'running'
+    session['deadline'] = time.monotonic() + seconds
+    session_id = session['id']
+    focus_session_timers[session_id] = timer_wheel.schedule(seconds, lambda: _on_session_deadline(session_id))
+
+def _get_own_session(session_id):
+    session = focus_sessions.get(session_id)
+    if not session or session['user'] != _current_user():
+        return None
+    return session
+
+@app.route('/api/focus_sessions', methods=['POST'])
+def start_focus_session():
+    """
+    Starts a server-timed focus session.
+    When its deadline passes the session completes and is logged as a Flow Block,
+    whether or not the browser tab is still open.
+    """
+    data = request.json or {}
+    mode = data.get('mode', 'work')
+    duration = data.get('duration_seconds', 25 * 60)
+    task_id = data.get('task_id')
+
+    if mode not in FOCUS_MODES:
+        return jsonify({"status": "error", "message": "mode must be work, break, or long-break"}), 400
+    if not isinstance(duration, int) or isinstance(duration, bool) or not 1 <= duration <= MAX_FOCUS_SECONDS:
+        return jsonify({"status": "error", "message": f"duration_seconds must be between 1 and {MAX_FOCUS_SECONDS}"}), 400
+
+    task_title, energy = 'No task selected', 'Unknown'
+    if task_id is not None:
+        task = next((t for t in _tenant(create=False)[1].tasks if t["id"] == task_id), None)
+        if not task:
+            return jsonify({"status": "error", "message": "Task not found"}), 404
+        task_title, energy = task['title'], task['cognitive_load']
+
+    session = {
+        "id": uuid.uuid4().hex,
+        "user": _current_user(),
+        "task_id": task_id,
+        "task_title": task_title,
+        "energy": energy,
+        "mode": mode,
+        "duration_seconds": duration,
+        "remaining_seconds": duration,
+        "started_at": datetime.datetime.now().isoformat()
+    }
+    timer_wheel.start()
+    with sessions_lock:
+        user_sessions = live_sessions.setdefault(session['user'], set())
+        if len(user_sessions) >= MAX_LIVE_SESSIONS_PER_USER:
+            return jsonify({"status": "error", "message": f"At most {MAX_LIVE_SESSIONS_PER_USER} running or paused sessions per user"}), 403
+        user_sessions.add(session['id'])
+        focus_sessions[session['id']] = session
+        _run_session(session, duration)
+        view = _session_view(session)
+    return jsonify({"status": "success", "session": view}), 201
+
+@app.route('/api/focus_sessions/<session_id>', methods=['GET'])
+def get_focus_session(session_id):
+    """Returns a focus session, including the seconds left while it is running."""
+    with sessions_lock:
+        session = _get_own_session(session_id)
+        if not session:
+            return jsonify({"status": "error", "message": "Session not found"}), 404
+        return jsonify({"status": "success", "session": _session_view(session)})
+
+@app.route('/api/focus_sessions/<session_id>/<action>', methods=['POST'])
+def update_focus_session(session_id, action):
+    """Pauses, resumes, completes or cancels a focus session."""
+    if action not in {'pause', 'resume', 'complete', 'cancel'}:
+        return jsonify({"status": "error", "message": "Unknown action"}), 404
+
+    with sessions_lock:
+        session = _get_own_session(session_id)
+        if not session:
+            return jsonify({"status": "error", "message": "Session not found"}), 404
+        state = session['state']
+
+        if action == 'complete' and state == 'completed':
+            pass  # already completed by the deadline timer
+        elif state in {'completed', 'cancelled'}:
+            return jsonify({"status": "error", "message": f"Session is already {state}"}), 409
+        elif action == 'pause':
+            if state == 'running':
+                timer_wheel.cancel(focus_session_timers.pop(session_id))
+                session['remaining_seconds'] = max(1, math.ceil(session['deadline'] - time.monotonic()))
+                session['state'] = 'paused'
+                focus_session_timers[session_id] = timer_wheel.schedule(
+                    PAUSED_SESSION_TTL, lambda: _on_pause_expired(session_id)
+                )
+        elif action == 'resume':
+            if state == 'paused':
+                timer_wheel.cancel(focus_session_timers.pop(session_id))
+                _run_session(session, session['remaining_seconds'])
+        elif action == 'complete':
+            _finish_session(session, 'completed')
+        else:
+            _finish_session(session, 'cancelled')
+
+        return jsonify({"status": "success", "session": _session_view(session)})
+
+# --- Response compression ---
+
+# Bodies smaller than this are sent uncompressed; the savings do not pay for the CPU.
+COMPRESS_MIN_BYTES = int(os.environ.get('RHYTHM_COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('RHYTHM_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('RHYTHM_BROTLI_QUALITY', '4'))
+COMPRESSIBLE_MIMETYPES = {
+    'application/json', 'application/x-ndjson', 'application/javascript', 'text/csv', 'text/html'
+}
+
+def _negotiate_encoding():
+    """Picks br (when brotli is installed) or gzip from Accept-Encoding."""
+    accepted = request.accept_encodings
+    if brotli and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+def _compress_stream(chunks, encoding):
+    """Compresses a chunked body incrementally, flushing after every chunk."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+        process = compressor.compress
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+        finish = compressor.flush
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode()
+            yield process(chunk) + flush()
+        yield finish()
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+@app.after_request
+def compress_response(response):
+    """Compresses JSON, NDJSON, CSV and page responses when the client accepts it."""
+    if (request.method == 'HEAD' or response.status_code in (204, 304) or response.status_code < 200
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _negotiate_encoding()
+    if not encoding:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    elif response.direct_passthrough or response.content_length < COMPRESS_MIN_BYTES:
+        return response
+    else:
+        response.set_data(_compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    # The encoded bytes differ from the identity representation.
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+# --- Idempotency ---
+# Mutating requests may carry an Idempotency-Key header. The first response for
+# a key is kept for a while and replayed to retries instead of re-running the
+# handler. These hooks are registered after compress_response, so Flask runs
+# the after_request hook first and the identity body is what gets stored.
+# Keys are scoped per user, not per endpoint: items of /api/tasks/bulk and
+# /api/import/activities may carry the key of the request they stand in for
+# (an offline client replaying its outbox), and are skipped once that key was
+# applied by either route.
+
+IDEMPOTENCY_TTL = float(os.environ.get('RHYTHM_IDEMPOTENCY_TTL', str(24 * 60 * 60)))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get('RHYTHM_IDEMPOTENCY_MAX_KEYS', '10000'))
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+MUTATING_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+class IdempotencyCache:
+    """
+    Bounded TTL map from scoped idempotency keys to stored responses.
+    A key is pending while its first request runs; keys expire in insertion
+    order, and the oldest are evicted once the cache is full. Keys applied as
+    an item of a batch hold APPLIED instead of a response.
+    """
+
+    PENDING = object()
+    APPLIED = object()
+
+    def __init__(self, ttl, max_keys):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.records = collections.OrderedDict()  # key -> (expires_at, record or PENDING)
+
+    def begin(self, key, now):
+        """Returns the stored record or PENDING for a known key; otherwise claims it and returns None."""
+        with self.lock:
+            self._expire(now)
+            item = self.records.get(key)
+            if item is not None:
+                return item[1]
+            self.records[key] = (now + self.ttl, self.PENDING)
+            while len(self.records) > self.max_keys:
+                self.records.popitem(last=False)
+            return None
+
+    def finish(self, key, record, now):
+        with self.lock:
+            self.records.pop(key, None)
+            self.records[key] = (now + self.ttl, record)
+
+    def abandon(self, key):
+        with self.lock:
+            item = self.records.get(key)
+            if item is not None and item[1] is self.PENDING:
+                del self.records[key]
+
+    def _expire(self, now):
+        while self.records:
+            key, (expires_at, _) = next(iter(self.records.items()))
+            if expires_at > now:
+                break
+            del self.records[key]
+
+idempotency_cache = IdempotencyCache(IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_KEYS)
+
+class IdempotencyKeyBusy(Exception):
+    """Raised when an item of a batch carries a key whose request is still running."""
+
+@app.errorhandler(IdempotencyKeyBusy)
+def idempotency_key_busy(error):
+    # 503 rather than 409: nothing is stored for the batch, so its retry runs again.
+    response = jsonify({"status": "error", "message": "An operation in this batch is still being applied; retry shortly"})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+def _valid_idempotency_key(key):
+    return isinstance(key, str) and 0 < len(key) <= IDEMPOTENCY_KEY_MAX_LENGTH
+
+def _claim_item_keys(keys):
+    """
+    Claims the idempotency keys carried by the items of a batch (None for items
+    without one). Returns (fresh, claimed): a flag per item, False when its key
+    was already applied or repeats an earlier item's, and the keys now held,
+    for _settle_item_keys. Raises IdempotencyKeyBusy while another request
+    still holds one of the keys.
+    """
+    user, now = _current_user(), time.time()
+    fresh, claimed = [], []
+    held = set()
+    for key in keys:
+        if not _valid_idempotency_key(key):
+            fresh.append(True)
+            continue
+        scoped_key = (user, key)
+        if scoped_key in held:
+            fresh.append(False)
+            continue
+        record = idempotency_cache.begin(scoped_key, now)
+        if record is IdempotencyCache.PENDING:
+            _settle_item_keys(claimed, applied=False)
+            raise IdempotencyKeyBusy()
+        if record is None:
+            held.add(scoped_key)
+            claimed.append(scoped_key)
+        fresh.append(record is None)
+    return fresh, claimed
+
+def _settle_item_keys(claimed, applied):
+    """Marks claimed item keys applied once their batch is committed, or releases them."""
+    now = time.time()
+    for scoped_key in claimed:
+        if applied:
+            idempotency_cache.finish(scoped_key, IdempotencyCache.APPLIED, now)
+        else:
+            idempotency_cache.abandon(scoped_key)
+
+@app.before_request
+def replay_idempotent_request():
+    """Replays the stored response for a repeated Idempotency-Key; 409 while the original is running."""
+    key = request.headers.get('Idempotency-Key')
+    if key is None or request.method not in MUTATING_METHODS or request.endpoint is None:
+        return None
+    if not _valid_idempotency_key(key):
+        return jsonify({"status": "error", "message": f"Idempotency-Key must be 1-{IDEMPOTENCY_KEY_MAX_LENGTH} characters"}), 400
+    scoped_key = (_current_user(), key)
+    record = idempotency_cache.begin(scoped_key, time.time())
+    if record is None:
+        g.idempotency_key = scoped_key
+        return None
+    if record is IdempotencyCache.PENDING:
+        return jsonify({"status": "error", "message": "A request with this Idempotency-Key is still in progress"}), 409
+    if record is IdempotencyCache.APPLIED:
+        return jsonify({"status": "error", "message": "This Idempotency-Key was already applied by a batch"}), 409
+    method, path, status, headers, body = record
+    if (method, path) != (request.method, request.path):
+        return jsonify({"status": "error", "message": "This Idempotency-Key was used for a different request"}), 422
+    g.idempotent_replay = True
+    response = Response(body, status=status, headers=headers)
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+@app.after_request
+def store_idempotent_response(response):
+    """Keeps the first complete, non-5xx response for a claimed key."""
+    key = g.pop('idempotency_key', None)
+    if key is None:
+        return response
+    if response.status_code >= 500 or response.is_streamed:
+        idempotency_cache.abandon(key)
+    else:
+        headers = [(k, v) for k, v in response.headers.items() if k not in ('Content-Length', 'Set-Cookie')]
+        record = (request.method, request.path, response.status_code, headers, response.get_data())
+        idempotency_cache.finish(key, record, time.time())
+    return response
+
+@app.teardown_request
+def release_idempotency_key(exc=None):
+    # Reached with the key still claimed only when the request failed before after_request.
+    key = g.pop('idempotency_key', None)
+    if key is not None:
+        idempotency_cache.abandon(key)
+
+# --- Export / Import ---
+
+TASK_FIELDS = ["id", "title", "source", "cognitive_load"]
+ACTIVITY_FIELDS = ["timestamp", "activity", "user"]
+# Rows per chunk yielded by exports and per batch committed by imports.
+EXPORT_CHUNK_ROWS = 500
+IMPORT_BATCH_SIZE = 1000
+# Import errors beyond this many are counted but not echoed back.
+MAX_REPORTED_IMPORT_ERRORS = 100
+
+def _stream_rows(rows, fields, fmt):
+    """Yields NDJSON or CSV text for rows in chunks of EXPORT_CHUNK_ROWS."""
+    buffer = io.StringIO()
+    writer = None
+    if fmt == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+
+    pending = 0
+    # Iterating the list object directly (not a copy) keeps memory flat; appends
+    # made while streaming are picked up; deletes and bulk writes replace the
+    # tenant's list, so the export keeps the list it started with.
+    for row in rows:
+        if writer:
+            writer.writerow(row)
+        else:
+            buffer.write(_json_dumps({k: row.get(k) for k in fields}))
+            buffer.write("\n")
+        pending += 1
+        if pending >= EXPORT_CHUNK_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def _export_response(rows, fields, name):
+    fmt = request.args.get('format', 'ndjson').lower()
+    if fmt not in {'ndjson', 'csv'}:
+        return jsonify({"status": "error", "message": "format must be ndjson or csv"}), 400
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = Response(_stream_rows(rows, fields, fmt), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{name}.{fmt}"'
+    return response
+
+def _iter_ndjson(stream):
+    """Parses an NDJSON body line by line, yielding (line_number, record, error)."""
+    for line_number, raw in enumerate(stream, start=1):
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            record = _json_loads(raw)
+        except ValueError as e:
+            yield line_number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, "Each line must be a JSON object"
+            continue
+        yield line_number, record, None
+
+def _import_report(imported, batches, errors, error_count, started, duplicates=0):
+    elapsed = time.perf_counter() - started
+    return jsonify({
+        "status": "success" if not error_count else "partial",
+        "imported": imported,
+        "duplicates": duplicates,
+        "batches": batches,
+        "failed": error_count,
+        "errors": errors,
+        "elapsed_ms": round(elapsed * 1000, 2),
+        "rows_per_second": round(imported / elapsed, 1) if elapsed > 0 else None
+    })
+
+@app.route('/api/export/tasks', methods=['GET'])
+def export_tasks():
+    """Streams the caller's tasks as NDJSON (default) or CSV (?format=csv)."""
+    return _export_response(_tenant(create=False)[1].tasks, TASK_FIELDS, 'tasks')
+
+@app.route('/api/export/activities', methods=['GET'])
+def export_activities():
+    """Streams the caller's activity log in timestamp order as NDJSON (default) or CSV (?format=csv)."""
+    shard, tenant = _tenant(create=False)
+    with shard.lock:
+        # Imports insert into the middle of the index, so stream from a copy.
+        activities = list(tenant.activities.entries['all'])
+    return _export_response(activities, ACTIVITY_FIELDS, 'activities')
+
+@app.route('/api/import/tasks', methods=['POST'])
+def import_tasks():
+    """
+    Imports tasks from an NDJSON body, one task object per line.
+    Lines are validated like POST /api/tasks and committed in batches; ids are
+    kept when free and reassigned otherwise.
+    """
+    started = time.perf_counter()
+    imported = batches = error_count = 0
+    errors = []
+    batch = []  # (requested id, fields)
+
+    def flush():
+        nonlocal imported, batches
+        if batch:
+            shard, tenant = _tenant()
+            with _span('store.write', op='tasks.bulk', records=len(batch)), shard.lock:
+                _check_quota(tenant, tasks=len(batch))
+                # Ids are checked under the lock, against tasks added concurrently too.
+                used_ids = {t["id"] for t in tenant.tasks}
+                next_id = max(used_ids, default=0) + 1
+                tasks = []
+                for task_id, fields in batch:
+                    if not isinstance(task_id, int) or isinstance(task_id, bool) or task_id < 1 or task_id in used_ids:
+                        task_id = next_id
+                    used_ids.add(task_id)
+                    next_id = max(next_id, task_id + 1)
+                    tasks.append({"id": task_id, **fields})
+                tenant.tasks.extend(tasks)
+                for task in tasks:
+                    tenant.task_queue.put(task)
+                # One record per batch, so recovery applies the whole batch or none of it.
+                seq = _persist('tasks.bulk', user=tenant.name, deletes=[], puts=tasks)
+            _wait_durable(seq)
+            imported += len(batch)
+            batches += 1
+            batch.clear()
+
+    try:
+        for line_number, record, error in _iter_ndjson(request.stream):
+            fields = None
+            if not error:
+                fields, error = _validate_task(record)
+            if error:
+                error_count += 1
+                if len(errors) < MAX_REPORTED_IMPORT_ERRORS:
+                    errors.append({"line": line_number, "message": error})
+                continue
+
+            batch.append((record.get('id'), fields))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush()
+        flush()
+    except QuotaExceeded as e:
+        # Earlier batches stay committed; the rest of the body is not read.
+        error_count += len(batch)
+        errors.append({"line": None, "message": str(e)})
+
+    return _import_report(imported, batches, errors, error_count, started)
+
+@app.route('/api/import/activities', methods=['POST'])
+def import_activities():
+    """
+    Imports activity log entries for the caller from an NDJSON body of
+    {timestamp, activity} objects. Entries are appended in batches; a missing
+    timestamp defaults to now. An entry may carry the "idempotency_key" of the
+    request it replays; one whose key was already applied is counted as a
+    duplicate and skipped.
+    """
+    started = time.perf_counter()
+    user = _current_user()
+    imported = batches = error_count = duplicates = 0
+    errors = []
+    batch = []
+    batch_keys = []
+
+    def flush():
+        nonlocal imported, batches, duplicates
+        if batch:
+            shard, tenant = _tenant(user)
+            fresh, claimed = _claim_item_keys(batch_keys)
+            entries = [entry for entry, keep in zip(batch, fresh) if keep]
+            committed = False
+            seq = 0
+            try:
+                if entries:
+                    with _span('store.write', op='activity.append', records=len(entries)), shard.lock:
+                        _check_quota(tenant, activities=len(entries))
+                        _append_activities(tenant, entries)
+                        seq = _persist('activity.append', entries=entries)
+                committed = True
+            finally:
+                _settle_item_keys(claimed, applied=committed)
+            _wait_durable(seq)
+            imported += len(entries)
+            duplicates += len(batch) - len(entries)
+            batches += 1
+            batch.clear()
+            batch_keys.clear()
+
+    try:
+        for line_number, record, error in _iter_ndjson(request.stream):
+            if not error:
+                activity = record.get('activity')
+                timestamp = record.get('timestamp') or datetime.datetime.now().isoformat()
+                if not isinstance(activity, str) or not activity.strip():
+                    error = "activity is required"
+                elif not isinstance(timestamp, str):
+                    error = "timestamp must be an ISO 8601 string"
+                else:
+                    try:
+                        timestamp = _normalize_timestamp(timestamp)
+                    except ValueError:
+                        error = "timestamp must be an ISO 8601 string"
+                if 'idempotency_key' in record and not _valid_idempotency_key(record['idempotency_key']):
+                    error = f"idempotency_key must be 1-{IDEMPOTENCY_KEY_MAX_LENGTH} characters"
+            if error:
+                error_count += 1
+                if len(errors) < MAX_REPORTED_IMPORT_ERRORS:
+                    errors.append({"line": line_number, "message": error})
+                continue
+
+            batch.append({"timestamp": timestamp, "activity": activity, "user": user})
+            batch_keys.append(record.get('idempotency_key'))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                flush()
+        flush()
+    except QuotaExceeded as e:
+        # Earlier batches stay committed; the rest of the body is not read.
+        error_count += len(batch)
+        errors.append({"line": None, "message": str(e)})
+
+    return _import_report(imported, batches, errors, error_count, started, duplicates)
 
 # --- 2. FRONTEND (HTML Template) ---
 HTML_TEMPLATE = """
@@ -347,18 +2734,33 @@ HTML_TEMPLATE = """
         .task-list {
             max-height: 400px;
             overflow-y: auto;
+            position: relative;
+        }
+        
+        /* Rows are virtualized: fixed height, absolutely positioned inside the spacer */
+        .task-list-spacer {
+            position: relative;
         }
         
         .task-item {
             display: flex;
             justify-content: space-between;
             align-items: center;
+            position: absolute;
+            left: 0;
+            right: 0;
+            height: 84px;
+            box-sizing: border-box;
             padding: 1rem;
             border: 1px solid #eee;
             border-radius: 8px;
-            margin-bottom: 0.5rem;
             cursor: pointer;
-            transition: all 0.3s ease;
+            transition: background 0.3s ease, border-color 0.3s ease;
+        }
+        
+        .task-info {
+            flex: 1;
+            min-width: 0;
         }
         
         .task-item:hover {
@@ -373,6 +2775,9 @@ HTML_TEMPLATE = """
         
         .task-info h3 {
             margin-bottom: 0.5rem;
+            white-space: nowrap;
+            overflow: hidden;
+            text-overflow: ellipsis;
         }
         
         .task-meta {
@@ -562,6 +2967,8 @@ HTML_TEMPLATE = """
                     <button id="saveJournal">Save Entry</button>
                 </div>
                 <div id="sentimentResult" style="margin-top: 1rem; padding: 1rem; background: #f0f0f0; border-radius: 8px; display: none;"></div>
+                <input id="journalSearch" placeholder="Search past entries..." style="width:100%; margin-top:1rem; padding:0.6rem 0.8rem; border:1px solid #ccc; border-radius:8px;" />
+                <div id="journalResults" style="margin-top: 0.5rem; max-height: 240px; overflow-y: auto;"></div>
             </div>
             
             <div class="card">
@@ -599,6 +3006,8 @@ HTML_TEMPLATE = """
                 selectedTask: null,
                 timerInterval: null,
                 timeLeft: 25 * 60,
+                sessionId: null,
+                endsAt: null,
                 isTimerRunning: false,
                 currentMode: 'work',
                 activities: [],
@@ -624,6 +3033,8 @@ HTML_TEMPLATE = """
             const analyzeSentimentBtn = document.getElementById('analyzeSentiment');
             const saveJournalBtn = document.getElementById('saveJournal');
             const sentimentResult = document.getElementById('sentimentResult');
+            const journalSearch = document.getElementById('journalSearch');
+            const journalResults = document.getElementById('journalResults');
             const generateSynthesisBtn = document.getElementById('generateSynthesis');
             const synthesisContent = document.getElementById('synthesisContent');
             const modeBtns = document.querySelectorAll('.mode-btn');
@@ -652,94 +3063,352 @@ HTML_TEMPLATE = """
                 const savedTheme = localStorage.getItem('theme') || 'light';
                 setTheme(savedTheme);
                 state.timeLeft = modes[state.currentMode];
-                loadTasks();
+                loadCachedState().finally(loadTasks);
                 updateTimerDisplay();
                 setupEventListeners();
                 customMinutesInput.placeholder = Math.floor(modes[state.currentMode] / 60).toString();
+                if ('serviceWorker' in navigator) {
+                    navigator.serviceWorker.register('/sw.js')
+                        .catch(err => console.error('Error registering service worker:', err));
+                }
+                flushOutbox();
+            };
+
+            // Local cache (IndexedDB): tasks, today's activities, and an outbox of
+            // mutations that could not reach the server yet.
+            const idb = (() => {
+                let dbPromise = null;
+                const open = () => {
+                    if (!('indexedDB' in window)) return Promise.reject(new Error('IndexedDB unavailable'));
+                    if (!dbPromise) {
+                        dbPromise = new Promise((resolve, reject) => {
+                            const req = indexedDB.open('rhythm', 1);
+                            req.onupgradeneeded = () => {
+                                const db = req.result;
+                                db.createObjectStore('tasks', { keyPath: 'id' });
+                                db.createObjectStore('activities', { autoIncrement: true });
+                                db.createObjectStore('outbox', { keyPath: 'seq', autoIncrement: true });
+                            };
+                            req.onsuccess = () => resolve(req.result);
+                            req.onerror = () => reject(req.error);
+                        });
+                    }
+                    return dbPromise;
+                };
+                const run = (storeName, mode, fn) => open().then(db => new Promise((resolve, reject) => {
+                    const tx = db.transaction(storeName, mode);
+                    const request = fn(tx.objectStore(storeName));
+                    tx.oncomplete = () => resolve(request ? request.result : undefined);
+                    tx.onerror = () => reject(tx.error);
+                }));
+                return {
+                    getAll: (storeName) => run(storeName, 'readonly', store => store.getAll()),
+                    put: (storeName, value) => run(storeName, 'readwrite', store => store.put(value)),
+                    remove: (storeName, keys) => run(storeName, 'readwrite', store => { keys.forEach(key => store.delete(key)); }),
+                    replaceAll: (storeName, values) => run(storeName, 'readwrite', store => {
+                        store.clear();
+                        values.forEach(value => store.put(value));
+                    })
+                };
+            })();
+
+            // Local ISO timestamp without a zone suffix, matching the server's log format
+            const localTimestamp = () => {
+                const now = new Date();
+                return new Date(now.getTime() - now.getTimezoneOffset() * 60000).toISOString().slice(0, -1);
+            };
+
+            // A failed fetch (offline) or 5xx is worth retrying later; 4xx is not.
+            const isRetryable = (err) => err instanceof TypeError || (err instanceof Response && err.status >= 500);
+            const fetchOk = (url, options) => fetch(url, options).then(res => res.ok ? res : Promise.reject(res));
+
+            const cacheError = (err) => console.error('Local cache error:', err);
+
+            // Render immediately from the local cache; loadTasks revalidates afterwards
+            const loadCachedState = () => Promise.all([idb.getAll('tasks'), idb.getAll('activities')])
+                .then(([tasks, activities]) => {
+                    if (!state.tasks.length && tasks.length) {
+                        state.tasks = tasks.sort((a, b) => (a.pending === b.pending ? a.id - b.id : a.pending ? 1 : -1));
+                        renderTasks();
+                    }
+                    const today = localTimestamp().slice(0, 10);
+                    state.activities = activities.filter(a => a.timestamp.startsWith(today));
+                    if (state.activities.length < activities.length) {
+                        idb.replaceAll('activities', state.activities).catch(cacheError);
+                    }
+                })
+                .catch(cacheError);
+
+            const recordLocalActivity = (entry) => {
+                state.activities.push(entry);
+                idb.put('activities', entry).catch(cacheError);
+            };
+
+            // Outbox: queued mutations are replayed in batches when connectivity returns
+            const OUTBOX_BATCH_SIZE = 500;
+            let outboxFlushing = false;
+
+            // Retries of a mutation reuse its Idempotency-Key so the server applies it once
+            const newIdempotencyKey = () => (window.crypto && crypto.randomUUID
+                ? crypto.randomUUID()
+                : `${Date.now()}-${Math.random().toString(36).slice(2)}`);
+            const idempotent = (headers, key = newIdempotencyKey()) => ({ ...headers, 'Idempotency-Key': key });
+            // A batch keeps the same key for as long as it holds the same outbox entries
+            const batchKey = (batch) => `outbox-${batch.length}-${batch[0].key || batch[0].seq}-${batch[batch.length - 1].key || batch[batch.length - 1].seq}`;
+
+            // Each item also carries the key of the request it stands in for, so an item the
+            // server applied before the connection dropped is skipped rather than applied again
+            const withItemKey = (entry) => ({ ...entry.payload, idempotency_key: entry.key });
+
+            const enqueueMutation = (type, payload, key = newIdempotencyKey()) => idb.put('outbox', { type, payload, key })
+                .then(flushOutbox)
+                .catch(cacheError);
+
+            const flushOutbox = async () => {
+                if (outboxFlushing || !navigator.onLine) return;
+                outboxFlushing = true;
+                let retryLater = false;
+                let flushAgain = false;
+                try {
+                    const entries = await idb.getAll('outbox');
+                    const activities = entries.filter(e => e.type === 'activity').slice(0, OUTBOX_BATCH_SIZE);
+                    const taskOps = entries.filter(e => e.type === 'task').slice(0, OUTBOX_BATCH_SIZE);
+
+                    if (activities.length) {
+                        await fetchOk('/api/import/activities', {
+                            method: 'POST',
+                            headers: idempotent({ 'Content-Type': 'application/x-ndjson' }, batchKey(activities)),
+                            body: activities.map(e => JSON.stringify(withItemKey(e))).join('\\n')
+                        });
+                        await idb.remove('outbox', activities.map(e => e.seq));
+                    }
+
+                    if (taskOps.length) {
+                        const res = await fetch('/api/tasks/bulk', {
+                            method: 'POST',
+                            headers: idempotent({ 'Content-Type': 'application/json' }, batchKey(taskOps)),
+                            body: JSON.stringify({ operations: taskOps.map(withItemKey) })
+                        });
+                        if (res.status >= 500) throw res;
+                        const data = await res.json();
+                        // A rejected batch is retried without the operations the server refused
+                        const done = res.ok
+                            ? taskOps
+                            : (data.results || []).filter(r => r.status === 'error').map(r => taskOps[r.index]);
+                        await idb.remove('outbox', done.map(e => e.seq));
+                        // The valid operations of a rejected batch go straight back out
+                        if (!res.ok && done.length && done.length < taskOps.length) flushAgain = true;
+                        if (res.ok) {
+                            // Temporary rows are replaced by the server's copies on reload
+                            const synced = new Set(taskOps.map(e => e.payload.temp_id));
+                            state.tasks = state.tasks.filter(t => !synced.has(t.id));
+                            loadTasks();
+                        }
+                    }
+
+                    // More than one batch was queued: keep going
+                    if (entries.length > activities.length + taskOps.length) flushAgain = true;
+                } catch (err) {
+                    console.error('Error syncing outbox:', err);
+                    retryLater = isRetryable(err);
+                } finally {
+                    outboxFlushing = false;
+                }
+                if (flushAgain) flushOutbox();
+                else if (retryLater) setTimeout(flushOutbox, 30000);
             };
 
-            // Load tasks from API
+            // Load tasks from API (after rendering any cached copy)
             const loadTasks = () => {
                 fetch('/api/tasks')
                     .then(res => res.json())
                     .then(data => {
-                        state.tasks = data.tasks;
+                        // Keep tasks created offline until their queued create is synced
+                        state.tasks = data.tasks.concat(state.tasks.filter(t => t.pending));
                         renderTasks();
+                        idb.replaceAll('tasks', state.tasks).catch(cacheError);
                     })
                     .catch(err => console.error('Error loading tasks:', err));
             };
 
-            // Render tasks
-            const renderTasks = () => {
-                taskList.innerHTML = '';
+            // Task list rendering is virtualized: only rows in (or near) the viewport
+            // exist in the DOM, row nodes are recycled, and one delegated handler
+            // on the list serves every row.
+            const TASK_ROW_HEIGHT = 92; // 84px row + 8px gap
+            const TASK_OVERSCAN = 4;
+            const taskView = {
+                filtered: [],
+                rows: new Map(), // task id -> row element currently on screen
+                pool: [],
+                spacer: document.createElement('div'),
+                frame: null
+            };
+            taskView.spacer.className = 'task-list-spacer';
+            taskList.appendChild(taskView.spacer);
+
+            const matchesTaskFilters = (task) => {
                 const query = (taskSearch.value || '').toLowerCase();
                 const filter = loadFilter.value;
+                const matchesQuery = task.title.toLowerCase().includes(query) || (task.source || '').toLowerCase().includes(query);
+                const matchesLoad = filter === 'all' ? true : task.cognitive_load === filter;
+                return matchesQuery && matchesLoad;
+            };
 
-                const filtered = state.tasks.filter(t => {
-                    const matchesQuery = t.title.toLowerCase().includes(query) || (t.source || '').toLowerCase().includes(query);
-                    const matchesLoad = filter === 'all' ? true : t.cognitive_load === filter;
-                    return matchesQuery && matchesLoad;
-                });
+            const createTaskRow = () => {
+                const row = document.createElement('div');
+                row.className = 'task-item';
+                row.innerHTML = `
+                    <div class="task-info">
+                        <h3></h3>
+                        <div class="task-meta"><span class="task-source"></span> • <span class="cognitive-load"></span></div>
+                    </div>
+                    <div style="display:flex; gap:0.5rem;">
+                        <button class="delete-task" title="Delete">🗑️</button>
+                    </div>
+                `;
+                return row;
+            };
 
-                filtered.forEach(task => {
-                    const taskElement = document.createElement('div');
-                    taskElement.className = 'task-item';
-                    taskElement.innerHTML = `
-                        <div class="task-info" style="flex:1;">
-                            <h3>${task.title}</h3>
-                            <div class="task-meta">
-                                ${task.source} • <span class="cognitive-load ${task.cognitive_load}">${task.cognitive_load}</span>
-                            </div>
-                        </div>
-                        <div style="display:flex; gap:0.5rem;">
-                            <button class="delete-task" data-id="${task.id}" title="Delete">🗑️</button>
-                        </div>
-                    `;
-                    // Select task when clicking on the row but not on buttons
-                    taskElement.addEventListener('click', (event) => {
-                        const target = event.target;
-                        const isButton = target instanceof Element && target.closest('button');
-                        if (isButton) return;
-                        selectTask(task, event);
-                    });
-                    // Delete handling
-                    const deleteBtn = taskElement.querySelector('.delete-task');
-                    deleteBtn.addEventListener('click', async (e) => {
-                        e.stopPropagation();
-                        if (!confirm('Delete this task?')) return;
-                        try {
-                            const res = await fetch(`/api/tasks/${task.id}`, { method: 'DELETE' });
-                            const data = await res.json();
-                            if (!res.ok) {
-                                alert(data.message || 'Failed to delete task');
-                                return;
-                            }
-                            // Update local state
-                            state.tasks = state.tasks.filter(t => t.id !== task.id);
-                            if (state.selectedTask && state.selectedTask.id === task.id) {
-                                state.selectedTask = null;
-                                currentTaskDiv.textContent = '';
-                            }
-                            renderTasks();
-                        } catch (err) {
-                            console.error('Error deleting task:', err);
-                            alert('Error deleting task');
-                        }
-                    });
-                    taskList.appendChild(taskElement);
-                });
+            const fillTaskRow = (row, task) => {
+                if (row.task === task) return;
+                row.task = task;
+                row.dataset.id = task.id;
+                row.querySelector('h3').textContent = task.title;
+                row.querySelector('.task-source').textContent = task.source;
+                const load = row.querySelector('.cognitive-load');
+                load.className = `cognitive-load ${task.cognitive_load}`;
+                load.textContent = task.cognitive_load;
+            };
+
+            const recycleTaskRow = (id) => {
+                const row = taskView.rows.get(id);
+                if (!row) return;
+                taskView.rows.delete(id);
+                row.style.display = 'none';
+                taskView.pool.push(row);
+            };
+
+            // Paint the rows for the current scroll window, reusing rows by task id
+            const renderTaskWindow = () => {
+                taskView.frame = null;
+                const { filtered } = taskView;
+                const viewport = taskList.clientHeight || 400;
+                const first = Math.max(0, Math.floor(taskList.scrollTop / TASK_ROW_HEIGHT) - TASK_OVERSCAN);
+                const last = Math.min(filtered.length, Math.ceil((taskList.scrollTop + viewport) / TASK_ROW_HEIGHT) + TASK_OVERSCAN);
+
+                const visible = new Set();
+                for (let i = first; i < last; i++) visible.add(filtered[i].id);
+                for (const id of [...taskView.rows.keys()]) {
+                    if (!visible.has(id)) recycleTaskRow(id);
+                }
+
+                const selectedId = state.selectedTask ? state.selectedTask.id : null;
+                for (let i = first; i < last; i++) {
+                    const task = filtered[i];
+                    let row = taskView.rows.get(task.id);
+                    if (!row) {
+                        row = taskView.pool.pop() || taskView.spacer.appendChild(createTaskRow());
+                        row.style.display = '';
+                        taskView.rows.set(task.id, row);
+                    }
+                    fillTaskRow(row, task);
+                    row.style.top = `${i * TASK_ROW_HEIGHT}px`;
+                    row.classList.toggle('selected', task.id === selectedId);
+                }
+            };
+
+            const scheduleTaskWindow = () => {
+                if (taskView.frame === null) taskView.frame = requestAnimationFrame(renderTaskWindow);
+            };
+
+            const updateTaskSpacer = () => {
+                taskView.spacer.style.height = `${taskView.filtered.length * TASK_ROW_HEIGHT}px`;
+            };
+
+            // Re-run the search/load filter over the data, then repaint the window
+            const renderTasks = () => {
+                taskView.filtered = state.tasks.filter(matchesTaskFilters);
+                updateTaskSpacer();
+                renderTaskWindow();
+            };
+
+            // Keyed updates for single adds/deletes, without refiltering the whole list
+            const insertTaskRow = (task) => {
+                if (!matchesTaskFilters(task)) return;
+                taskView.filtered.push(task);
+                updateTaskSpacer();
+                scheduleTaskWindow();
+            };
+
+            const removeTaskRow = (taskId) => {
+                const index = taskView.filtered.findIndex(t => t.id === taskId);
+                if (index === -1) return;
+                taskView.filtered.splice(index, 1);
+                recycleTaskRow(taskId);
+                updateTaskSpacer();
+                scheduleTaskWindow();
+            };
+
+            const forgetTask = (task) => {
+                state.tasks = state.tasks.filter(t => t.id !== task.id);
+                if (state.selectedTask && state.selectedTask.id === task.id) {
+                    state.selectedTask = null;
+                    currentTaskDiv.textContent = '';
+                }
+                removeTaskRow(task.id);
+                idb.remove('tasks', [task.id]).catch(cacheError);
+            };
+
+            const deleteTask = async (task) => {
+                if (!confirm('Delete this task?')) return;
+                if (task.pending) {
+                    // Never reached the server: drop its queued create instead
+                    idb.getAll('outbox')
+                        .then(entries => idb.remove('outbox', entries
+                            .filter(e => e.type === 'task' && e.payload.temp_id === task.id)
+                            .map(e => e.seq)))
+                        .catch(cacheError);
+                    forgetTask(task);
+                    return;
+                }
+                const key = newIdempotencyKey();
+                try {
+                    const res = await fetch(`/api/tasks/${task.id}`, { method: 'DELETE', headers: idempotent({}, key) });
+                    const data = await res.json();
+                    if (!res.ok && res.status < 500) {
+                        alert(data.message || 'Failed to delete task');
+                        return;
+                    }
+                    if (!res.ok) throw res;
+                    forgetTask(task);
+                } catch (err) {
+                    if (!isRetryable(err)) {
+                        console.error('Error deleting task:', err);
+                        alert('Error deleting task');
+                        return;
+                    }
+                    enqueueMutation('task', { op: 'delete', id: task.id }, key);
+                    forgetTask(task);
+                }
+            };
+
+            // One delegated handler for selection and deletion on every row
+            const handleTaskListClick = (event) => {
+                const target = event.target;
+                const row = target instanceof Element && target.closest('.task-item');
+                if (!row || !row.task) return;
+                if (target.closest('.delete-task')) {
+                    event.stopPropagation();
+                    deleteTask(row.task);
+                } else if (!target.closest('button')) {
+                    selectTask(row.task);
+                }
             };
 
             // Select task
-            const selectTask = (task, event) => {
-                // Remove previous selection
-                document.querySelectorAll('.task-item').forEach(item => {
-                    item.classList.remove('selected');
-                });
-                
-                // Add selection to clicked task
-                event.currentTarget.classList.add('selected');
+            const selectTask = (task) => {
                 state.selectedTask = task;
+                taskView.rows.forEach((row, id) => row.classList.toggle('selected', id === task.id));
                 currentTaskDiv.textContent = `Selected: ${task.title}`;
             };
 
@@ -750,33 +3419,76 @@ HTML_TEMPLATE = """
                 timerDisplay.textContent = `${minutes.toString().padStart(2, '0')}:${seconds.toString().padStart(2, '0')}`;
             };
 
-            const startTimer = () => {
-                if (state.isTimerRunning) return;
-                
+            // The server owns the session deadline; the interval only repaints the
+            // countdown from it, so throttled background tabs do not drift.
+            const focusRequest = (path, body) => fetch(path, {
+                method: 'POST',
+                headers: idempotent({ 'Content-Type': 'application/json' }),
+                body: JSON.stringify(body || {})
+            }).then(res => res.ok ? res.json() : Promise.reject(res));
+
+            const runCountdown = (seconds) => {
+                state.endsAt = Date.now() + seconds * 1000;
                 state.isTimerRunning = true;
+                clearInterval(state.timerInterval);
                 state.timerInterval = setInterval(() => {
-                    state.timeLeft--;
+                    state.timeLeft = Math.max(0, Math.ceil((state.endsAt - Date.now()) / 1000));
                     updateTimerDisplay();
-                    
+
                     if (state.timeLeft <= 0) {
                         completeTimer();
                     }
                 }, 1000);
-                
                 startBtn.disabled = true;
                 pauseBtn.disabled = false;
             };
 
+            const startTimer = () => {
+                if (state.isTimerRunning) return;
+
+                const request = state.sessionId
+                    ? focusRequest(`/api/focus_sessions/${state.sessionId}/resume`)
+                    : focusRequest('/api/focus_sessions', {
+                        task_id: state.selectedTask ? state.selectedTask.id : null,
+                        mode: state.currentMode,
+                        duration_seconds: state.timeLeft
+                    });
+                request
+                    .then(data => {
+                        state.sessionId = data.session.id;
+                        runCountdown(data.session.remaining_seconds);
+                    })
+                    .catch(err => {
+                        // Offline or server unavailable: fall back to a local-only timer.
+                        console.error('Error starting focus session:', err);
+                        state.sessionId = null;
+                        runCountdown(state.timeLeft);
+                    });
+            };
+
             const pauseTimer = () => {
                 state.isTimerRunning = false;
                 clearInterval(state.timerInterval);
                 startBtn.disabled = false;
                 pauseBtn.disabled = true;
+                if (state.sessionId) {
+                    focusRequest(`/api/focus_sessions/${state.sessionId}/pause`)
+                        .then(data => {
+                            state.timeLeft = data.session.remaining_seconds;
+                            updateTimerDisplay();
+                        })
+                        .catch(err => console.error('Error pausing focus session:', err));
+                }
             };
 
             const resetTimer = () => {
                 state.isTimerRunning = false;
                 clearInterval(state.timerInterval);
+                if (state.sessionId) {
+                    focusRequest(`/api/focus_sessions/${state.sessionId}/cancel`)
+                        .catch(err => console.error('Error cancelling focus session:', err));
+                    state.sessionId = null;
+                }
                 state.timeLeft = modes[state.currentMode];
                 updateTimerDisplay();
                 startBtn.disabled = false;
@@ -788,21 +3500,51 @@ HTML_TEMPLATE = """
                 clearInterval(state.timerInterval);
                 startBtn.disabled = false;
                 pauseBtn.disabled = true;
-                
-                // Log activity
+
                 const energy = state.selectedTask ? state.selectedTask.cognitive_load : 'Unknown';
                 const activity = `Flow Block completed: ${state.selectedTask ? state.selectedTask.title : 'No task selected'} (${state.currentMode} mode, ${energy} energy)`;
-                logActivity(activity);
-                
+                if (state.sessionId) {
+                    // The server logs the Flow Block (possibly already, at its deadline).
+                    focusRequest(`/api/focus_sessions/${state.sessionId}/complete`)
+                        .then(() => recordLocalActivity({ activity, timestamp: localTimestamp() }))
+                        .catch(err => {
+                            console.error('Error completing focus session:', err);
+                            // The session is gone (server restart, expiry) or unreachable: log the
+                            // block directly, which queues it in the outbox when offline.
+                            // 409 means it was cancelled, so there is nothing to log.
+                            if (!(err instanceof Response && err.status === 409)) logActivity(activity);
+                        });
+                    state.sessionId = null;
+                } else {
+                    logActivity(activity);
+                }
+
                 alert('Timer completed! Great work!');
                 resetTimer();
             };
 
+            // Re-sync with the server when a throttled tab becomes visible again
+            const syncFocusSession = () => {
+                if (document.hidden || !state.sessionId || !state.isTimerRunning) return;
+                fetch(`/api/focus_sessions/${state.sessionId}`)
+                    .then(res => res.json())
+                    .then(data => {
+                        if (!data.session) return;
+                        if (data.session.state === 'completed') {
+                            completeTimer();
+                        } else if (data.session.state === 'running') {
+                            state.endsAt = Date.now() + data.session.remaining_seconds * 1000;
+                        }
+                    })
+                    .catch(err => console.error('Error syncing focus session:', err));
+            };
+
             // Mode switching
             const switchMode = (mode) => {
                 if (state.isTimerRunning) {
                     if (!confirm('Timer is running. Switch mode and reset timer?')) return;
                 }
+                resetTimer();
                 
                 state.currentMode = mode;
                 state.timeLeft = modes[mode];
@@ -846,6 +3588,7 @@ HTML_TEMPLATE = """
                     return;
                 }
                 if (state.isTimerRunning && !confirm('Timer is running. Apply new duration and reset?')) return;
+                resetTimer();
                 const seconds = Math.floor(value * 60);
                 modes[state.currentMode] = seconds;
                 const toPersist = { work: modes.work, break: modes.break, 'long-break': modes['long-break'] };
@@ -856,21 +3599,22 @@ HTML_TEMPLATE = """
                 customMinutesInput.placeholder = String(value);
             };
 
-            // Activity logging
+            // Activity logging (queued in the outbox when the server is unreachable)
             const logActivity = (activity) => {
-                fetch('/api/log_activity', {
+                const entry = { activity, timestamp: localTimestamp() };
+                const key = newIdempotencyKey();
+                recordLocalActivity(entry);
+                fetchOk('/api/log_activity', {
                     method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
+                    headers: idempotent({ 'Content-Type': 'application/json' }, key),
                     body: JSON.stringify({ activity })
                 })
                 .then(res => res.json())
-                .then(data => {
-                    console.log('Activity logged:', data);
-                    state.activities.push({ activity, timestamp: new Date().toISOString() });
-                })
-                .catch(err => console.error('Error logging activity:', err));
+                .then(data => console.log('Activity logged:', data))
+                .catch(err => {
+                    console.error('Error logging activity:', err);
+                    if (isRetryable(err)) enqueueMutation('activity', entry, key);
+                });
             };
 
             // Sentiment analysis
@@ -883,9 +3627,7 @@ HTML_TEMPLATE = """
 
                 fetch('/api/sentiment', {
                     method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
+                    headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify({ text })
                 })
                 .then(res => res.json())
@@ -896,8 +3638,6 @@ HTML_TEMPLATE = """
                         Polarity: ${data.polarity} (${data.polarity > 0.1 ? 'Positive' : data.polarity < -0.1 ? 'Negative' : 'Neutral'})<br>
                         Subjectivity: ${data.subjectivity} (${data.subjectivity > 0.5 ? 'Subjective' : 'Objective'})
                     `;
-                    // Log activity with polarity so synthesis can use it
-                    logActivity(`Wrote a journal entry with polarity: ${data.polarity}`);
                 })
                 .catch(err => console.error('Error analyzing sentiment:', err));
             };
@@ -910,26 +3650,83 @@ HTML_TEMPLATE = """
                     return;
                 }
 
-                logActivity(`Wrote a journal entry: ${text.substring(0, 50)}...`);
-                journalText.value = '';
-                sentimentResult.style.display = 'none';
-                alert('Journal entry saved!');
-            };
-
-            // Generate synthesis
-            const generateSynthesis = () => {
-                fetch('/api/synthesis', {
+                fetch('/api/journal', {
                     method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify({ activities: state.activities })
+                    headers: idempotent({ 'Content-Type': 'application/json' }),
+                    body: JSON.stringify({ text })
                 })
-                .then(res => res.json())
+                .then(res => res.json().then(data => (res.ok ? data : Promise.reject(data))))
                 .then(data => {
-                    synthesisContent.textContent = data.summary;
+                    recordLocalActivity({
+                        activity: `Wrote a journal entry with polarity: ${data.entry.polarity}`,
+                        timestamp: data.entry.created_at
+                    });
+                    journalText.value = '';
+                    sentimentResult.style.display = 'none';
+                    alert('Journal entry saved!');
                 })
-                .catch(err => console.error('Error generating synthesis:', err));
+                .catch(err => {
+                    console.error('Error saving journal entry:', err);
+                    alert((err && err.message) || 'Error saving journal entry');
+                });
+            };
+
+            // Journal search (debounced)
+            let journalSearchTimer = null;
+            const searchJournal = () => {
+                clearTimeout(journalSearchTimer);
+                journalSearchTimer = setTimeout(() => {
+                    const query = journalSearch.value.trim();
+                    if (!query) {
+                        journalResults.replaceChildren();
+                        return;
+                    }
+                    fetch(`/api/journal?q=${encodeURIComponent(query)}&limit=20`)
+                        .then(res => res.json())
+                        .then(data => {
+                            journalResults.replaceChildren(...(data.results || []).map(entry => {
+                                const item = document.createElement('div');
+                                item.style.cssText = 'padding: 0.5rem 0; border-bottom: 1px solid #eee;';
+                                const meta = document.createElement('div');
+                                meta.className = 'task-meta';
+                                meta.textContent = `${entry.created_at.slice(0, 16).replace('T', ' ')} • polarity ${entry.polarity}`;
+                                const body = document.createElement('div');
+                                body.textContent = entry.text;
+                                item.append(meta, body);
+                                return item;
+                            }));
+                        })
+                        .catch(err => console.error('Error searching journal:', err));
+                }, 250);
+            };
+
+            // Generate synthesis (revalidates the cached summary via ETag)
+            // Summarises the locally cached activities (today's, including any still
+            // waiting in the outbox that the server has not seen yet)
+            const localSynthesis = () => fetchOk('/api/synthesis', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ activities: state.activities })
+            });
+
+            const generateSynthesis = async () => {
+                try {
+                    const unsynced = (await idb.getAll('outbox').catch(() => [])).some(e => e.type === 'activity');
+                    let res;
+                    try {
+                        res = unsynced ? await localSynthesis() : await fetchOk('/api/synthesis', { cache: 'no-cache' });
+                    } catch (err) {
+                        if (unsynced || !isRetryable(err)) throw err;
+                        res = await localSynthesis();
+                    }
+                    const data = await res.json();
+                    synthesisContent.textContent = data.summary;
+                } catch (err) {
+                    console.error('Error generating synthesis:', err);
+                    if (isRetryable(err)) {
+                        synthesisContent.textContent = 'Synthesis is unavailable while offline. Your activities are saved and will sync when you reconnect.';
+                    }
+                }
             };
 
             // Mindfulness functions
@@ -950,9 +3747,7 @@ HTML_TEMPLATE = """
                 const chosenType = '4-7-8';
                 fetch('/api/breathing_exercise', {
                     method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
+                    headers: idempotent({ 'Content-Type': 'application/json' }),
                     body: JSON.stringify({ type: chosenType })
                 })
                 .then(res => res.json())
@@ -1031,6 +3826,7 @@ HTML_TEMPLATE = """
                 startBtn.addEventListener('click', startTimer);
                 pauseBtn.addEventListener('click', pauseTimer);
                 resetBtn.addEventListener('click', resetTimer);
+                document.addEventListener('visibilitychange', syncFocusSession);
                 
                 modeBtns.forEach(btn => {
                     btn.addEventListener('click', () => switchMode(btn.dataset.mode));
@@ -1041,6 +3837,7 @@ HTML_TEMPLATE = """
                 
                 analyzeSentimentBtn.addEventListener('click', analyzeSentiment);
                 saveJournalBtn.addEventListener('click', saveJournal);
+                journalSearch.addEventListener('input', searchJournal);
                 generateSynthesisBtn.addEventListener('click', generateSynthesis);
                 
                 // Mindfulness event listeners
@@ -1051,29 +3848,44 @@ HTML_TEMPLATE = """
                 // Task interactions
                 taskSearch.addEventListener('input', renderTasks);
                 loadFilter.addEventListener('change', renderTasks);
+                taskList.addEventListener('click', handleTaskListClick);
+                taskList.addEventListener('scroll', scheduleTaskWindow, { passive: true });
                 addTaskBtn.addEventListener('click', async () => {
                     const title = prompt('Task title:');
                     if (!title) return;
                     const source = prompt('Source (e.g., me, work):', 'me') || 'me';
                     const load = prompt('Cognitive load (High/Medium/Low):', 'Medium') || 'Medium';
+                    const key = newIdempotencyKey();
+                    let task;
                     try {
                         const res = await fetch('/api/tasks', {
                             method: 'POST',
-                            headers: { 'Content-Type': 'application/json' },
+                            headers: idempotent({ 'Content-Type': 'application/json' }, key),
                             body: JSON.stringify({ title, source, cognitive_load: load })
                         });
+                        if (res.status >= 500) throw res;
                         const data = await res.json();
                         if (!res.ok) {
                             alert(data.message || 'Failed to add task');
                             return;
                         }
-                        state.tasks.push(data.task);
-                        renderTasks();
+                        task = data.task;
                     } catch (e) {
-                        console.error('Error adding task:', e);
-                        alert('Error adding task');
+                        if (!isRetryable(e)) {
+                            console.error('Error adding task:', e);
+                            alert('Error adding task');
+                            return;
+                        }
+                        // Offline: show it now with a temporary id and sync the create later
+                        const cognitiveLoad = load.trim().charAt(0).toUpperCase() + load.trim().slice(1).toLowerCase();
+                        task = { id: -Date.now(), title: title.trim(), source: source.trim() || 'Me', cognitive_load: cognitiveLoad, pending: true };
+                        enqueueMutation('task', { op: 'create', title, source, cognitive_load: load, temp_id: task.id }, key);
                     }
+                    state.tasks.push(task);
+                    insertTaskRow(task);
+                    idb.put('tasks', task).catch(cacheError);
                 });
+                window.addEventListener('online', flushOutbox);
             };
 
             // Initialize the app
@@ -1084,7 +3896,52 @@ HTML_TEMPLATE = """
 </html>
 """
 
+# Service worker: serves the app shell from cache and refreshes it in the background.
+SERVICE_WORKER_JS = """
+const SHELL_CACHE = 'rhythm-shell-v1';
+const SHELL_URLS = ['/'];
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(SHELL_CACHE)
+            .then(cache => cache.addAll(SHELL_URLS))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(keys.filter(key => key !== SHELL_CACHE).map(key => caches.delete(key))))
+            .then(() => self.clients.claim())
+    );
+});
+
+self.addEventListener('fetch', event => {
+    const url = new URL(event.request.url);
+    if (event.request.method !== 'GET' || url.origin !== self.location.origin || !SHELL_URLS.includes(url.pathname)) {
+        return;
+    }
+    event.respondWith(caches.open(SHELL_CACHE).then(async cache => {
+        const cached = await cache.match(event.request);
+        const network = fetch(event.request).then(response => {
+            if (response.ok) cache.put(event.request, response.clone());
+            return response;
+        });
+        if (cached) {
+            event.waitUntil(network.catch(() => {}));
+            return cached;
+        }
+        return network;
+    }));
+});
+"""
+
 # --- 3. RUN THE APPLICATION ---
 
+_init_tracing()
+_init_persistence()
+
 if __name__ == '__main__':
-    app.run(debug=True)
+    # The reloader would run a second process against the same data directory.
+    app.run(debug=True, use_reloader=not DATA_DIR)
@@ -0,0 +1,72 @@
+"""
+CPU-versus-bytes benchmark for response compression.
+
+Compresses representative bodies (a task list, an activity NDJSON export, the
+app page and a body just under RHYTHM_COMPRESS_MIN_BYTES) with gzip at levels
+1, 6 and 9 and, when brotli is installed, Brotli at qualities 1, 4 and 11.
+For each it prints the compressed size and the CPU time per body.
+
+    python bench/compression.py [repeats]
+"""
+import gzip
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault('RHYTHM_RATE_LIMIT', '0')
+
+import app as rhythm  # noqa: E402
+
+
+def payloads():
+    loads = ['Low', 'Medium', 'High']
+    tasks = [{"id": i, "title": f"Review pull request #{i}", "source": "github",
+              "cognitive_load": loads[i % 3]} for i in range(500)]
+    activities = "".join(json.dumps({
+        "timestamp": f"2026-01-01T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}",
+        "activity": f"Flow Block completed: Review pull request #{i} (work mode, {loads[i % 3]} energy)"
+    }) + "\n" for i in range(5000))
+    small = json.dumps({"tasks": tasks[:12]}).encode()[:rhythm.COMPRESS_MIN_BYTES - 1]
+    return [
+        ("tasks (500)", json.dumps({"tasks": tasks}).encode()),
+        ("activities.ndjson (5000)", activities.encode()),
+        ("page", rhythm.HTML_TEMPLATE.encode()),
+        ("below threshold", small),
+    ]
+
+
+def codecs():
+    for level in (1, 6, 9):
+        yield f"gzip -{level}", lambda data, level=level: gzip.compress(data, compresslevel=level)
+    if rhythm.brotli:
+        for quality in (1, 4, 11):
+            yield f"br q{quality}", lambda data, quality=quality: rhythm.brotli.compress(data, quality=quality)
+
+
+def measure(compress, data, repeats):
+    size = len(compress(data))
+    started = time.process_time()
+    for _ in range(repeats):
+        compress(data)
+    return size, (time.process_time() - started) / repeats
+
+
+def main():
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    if not rhythm.brotli:
+        print("brotli is not installed; gzip only")
+    print(f"defaults: gzip -{rhythm.GZIP_LEVEL}, br q{rhythm.BROTLI_QUALITY}, "
+          f"min {rhythm.COMPRESS_MIN_BYTES} bytes")
+    for name, data in payloads():
+        print(f"\n{name}: {len(data):,} bytes")
+        for label, compress in codecs():
+            size, seconds = measure(compress, data, repeats)
+            print(f"  {label:9} {size:9,} bytes  {size / len(data):6.1%}  "
+                  f"{seconds * 1000:8.3f} ms CPU  {len(data) / seconds / 2**20:8.1f} MiB/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Requests-per-second benchmark for the mindfulness tip and breathing endpoints.
+
+Times N requests (default 20,000) through the Flask test client against the
+pre-encoded catalog, and against "before" routes that build the content dicts
+and go through jsonify on every request, as the handlers used to.
+
+    python bench/content.py [requests]
+"""
+import datetime
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault('RHYTHM_RATE_LIMIT', '0')
+
+import app as rhythm  # noqa: E402
+from flask import jsonify, request  # noqa: E402
+
+app = rhythm.app
+
+
+@app.route('/bench/before/mindfulness_tip', methods=['GET'])
+def tip_before():
+    tips = {period: list(entries) for period, entries in rhythm.DEFAULT_CONTENT['tips'].items()}
+    time_period = rhythm._time_period(datetime.datetime.now().hour)
+    return jsonify({
+        "tip": random.choice(tips[time_period]),
+        "time_period": time_period,
+        "timestamp": datetime.datetime.now().isoformat()
+    })
+
+
+@app.route('/bench/before/breathing_exercise', methods=['POST'])
+def breathing_before():
+    exercises = {key: dict(exercise) for key, exercise in rhythm.DEFAULT_CONTENT['exercises'].items()}
+    exercise = exercises.get(request.json.get('type', '4-7-8'), exercises['4-7-8'])
+    rhythm._log_event(f"Completed {exercise['name']} breathing exercise")
+    return jsonify(exercise)
+
+
+def rate(client, requests, method, path, **kwargs):
+    call = getattr(client, method)
+    started = time.perf_counter()
+    for _ in range(requests):
+        assert call(path, **kwargs).status_code == 200
+    return requests / (time.perf_counter() - started)
+
+
+def main():
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    client = app.test_client()
+    cases = [
+        ('GET /api/mindfulness_tip', 'get', '/bench/before/mindfulness_tip', '/api/mindfulness_tip', {}),
+        ('POST /api/breathing_exercise', 'post', '/bench/before/breathing_exercise', '/api/breathing_exercise',
+         {'json': {'type': 'box'}}),
+    ]
+    for label, method, before, after, kwargs in cases:
+        rate(client, requests // 10, method, after, **kwargs)  # warm up
+        old = rate(client, requests, method, before, **kwargs)
+        new = rate(client, requests, method, after, **kwargs)
+        print(f"{label:30} before {old:8,.0f} req/s   after {new:8,.0f} req/s   ({new / old:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
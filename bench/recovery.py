@@ -0,0 +1,69 @@
+"""
+Recovery benchmark for the write-ahead log.
+
+Writes a WAL of N records (default 1,000,000: a mix of task puts, deletes and
+activity appends), then times two cold starts in fresh processes:
+replaying the whole log (which also writes the compacted snapshot), and
+loading that snapshot alone.
+
+    python bench/recovery.py [records]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+
+START = """
+import time
+started = time.perf_counter()
+import app
+shard, tenant = app._tenant('default')
+print(time.perf_counter() - started, len(tenant.tasks), len(tenant.activities))
+"""
+
+
+def write_wal(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        for seq in range(1, records + 1):
+            if seq % 10 == 0:
+                record = {"seq": seq, "op": "task.delete", "user": "default", "id": seq - 5}
+            elif seq % 2 == 0:
+                task = {"id": seq, "title": f"task {seq}", "source": "bench", "cognitive_load": "Medium"}
+                record = {"seq": seq, "op": "task.put", "user": "default", "task": task}
+            else:
+                entry = {"timestamp": f"2026-01-01T00:00:{seq % 60:02d}.{seq:06d}",
+                         "activity": f"Flow Block completed: task {seq} (work mode, High energy)", "user": "default"}
+                record = {"seq": seq, "op": "activity.append", "entries": [entry]}
+            f.write(json.dumps(record) + "\n")
+
+
+def cold_start(data_dir):
+    env = dict(os.environ, PYTHONPATH=str(ROOT), RHYTHM_DATA_DIR=data_dir, RHYTHM_WAL_FSYNC='off')
+    output = subprocess.run([sys.executable, '-c', START], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout.split()
+    return float(output[0]), int(output[1]), int(output[2])
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    with tempfile.TemporaryDirectory() as data_dir:
+        started = time.perf_counter()
+        write_wal(os.path.join(data_dir, 'wal.ndjson'), records)
+        size = os.path.getsize(os.path.join(data_dir, 'wal.ndjson'))
+        print(f"wrote {records:,} records ({size / 2**20:.1f} MiB) in {time.perf_counter() - started:.1f}s")
+
+        seconds, tasks, activities = cold_start(data_dir)
+        print(f"replay WAL + compact: {seconds:.2f}s ({records / seconds:,.0f} records/s), "
+              f"{tasks:,} tasks, {activities:,} activities")
+
+        seconds, tasks, activities = cold_start(data_dir)
+        print(f"load snapshot:        {seconds:.2f}s, {tasks:,} tasks, {activities:,} activities")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Tests for the incremental JSON array parser behind POST /api/synthesis.
+
+Bodies are fed through tiny read sizes so items, numbers and the closing
+brace are split across reads at every possible offset.
+"""
+import io
+import json
+
+import pytest
+
+import app
+
+READ_SIZES = [1, 2, 3, 7, 64 * 1024]
+
+
+def _parse(body, read_size, monkeypatch):
+    monkeypatch.setattr(app, 'STREAM_READ_SIZE', read_size)
+    return list(app._iter_json_array(io.BytesIO(body.encode()), 'activities', 1 << 20))
+
+
+@pytest.mark.parametrize('read_size', READ_SIZES)
+@pytest.mark.parametrize('body', [
+    '{"activities": []}',
+    '{"activities":[ ]}',
+    '{"activities": [2.5, -10, 1e3, 12345678, 0.25E-2]}',
+    '{"activities": [true, null, "a, b", {"x": [1, 2]}]}',
+    '{"activities": [1, 2], "note": "extra keys may follow"}',
+    ' {"activities": [{"activity": "x", "timestamp": "2026-01-01T00:00:00"}]} \n',
+])
+def test_valid_bodies_match_json_loads(body, read_size, monkeypatch):
+    assert _parse(body, read_size, monkeypatch) == json.loads(body)['activities']
+
+
+@pytest.mark.parametrize('read_size', READ_SIZES)
+@pytest.mark.parametrize('body', [
+    '{"activities": [1 2]}',
+    '{"activities": [1,,2]}',
+    '{"activities": [,1]}',
+    '{"activities": [1,]}',
+    '{"activities": [{"a": 1} {"a": 2}]}',
+    '{"activities": [1',
+    '{"activities": [] garbage',
+    '{"activities": []',
+    '{"activities": []}}',
+    '{"activities": [2.5.1]}',
+])
+def test_malformed_bodies_are_rejected(body, read_size, monkeypatch):
+    with pytest.raises(ValueError):
+        _parse(body, read_size, monkeypatch)
+
+
+def test_malformed_body_returns_400(monkeypatch):
+    monkeypatch.setattr(app, 'STREAM_READ_SIZE', 3)
+    client = app.app.test_client()
+    response = client.post('/api/synthesis', data='{"activities": [] garbage', content_type='application/json')
+    assert response.status_code == 400
@@ -0,0 +1,161 @@
+"""
+Crash-consistency tests for the write-ahead log.
+
+Each test runs the app in a child process against a temporary data directory,
+kills it with SIGKILL part-way through a stream of writes, then starts a fresh
+process on the same directory and checks what recovery restored.
+"""
+import json
+import os
+import signal
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+
+pytestmark = pytest.mark.skipif(os.name != 'posix', reason="needs SIGKILL and fcntl")
+
+RECOVER = """
+import json, app
+shard, tenant = app._tenant('default')
+print(json.dumps({
+    "tasks": [t['title'] for t in tenant.tasks],
+    "activities": [a['activity'] for a in tenant.activities.entries['all']],
+}))
+"""
+
+
+def _env(data_dir, **overrides):
+    env = dict(os.environ, PYTHONPATH=str(ROOT), RHYTHM_DATA_DIR=str(data_dir), RHYTHM_RATE_LIMIT='0',
+               RHYTHM_TENANT_MAX_TASKS='1000000', RHYTHM_WAL_COMMIT_MS='0')
+    env.update(overrides)
+    return env
+
+
+def _run_and_kill(data_dir, code, acks, **env):
+    """Runs code (which prints one line per acknowledged write) and SIGKILLs it after `acks` lines."""
+    child = subprocess.Popen([sys.executable, '-c', textwrap.dedent(code)], cwd=ROOT,
+                             env=_env(data_dir, **env), stdout=subprocess.PIPE, text=True)
+    acknowledged = []
+    try:
+        for line in child.stdout:
+            acknowledged.append(line.strip())
+            if len(acknowledged) >= acks:
+                break
+    finally:
+        child.send_signal(signal.SIGKILL)
+        child.wait(timeout=30)
+    assert len(acknowledged) >= acks, "writer exited before it was killed"
+    return acknowledged
+
+
+def _recover(data_dir, **env):
+    result = subprocess.run([sys.executable, '-c', RECOVER], cwd=ROOT, env=_env(data_dir, **env),
+                            capture_output=True, text=True, timeout=120, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+BULK_WRITER = """
+import app
+client = app.app.test_client()
+batch = 0
+while True:
+    operations = [{'op': 'create', 'title': f'b{batch}-{i}'} for i in range(50)]
+    assert client.post('/api/tasks/bulk', json={'operations': operations}).status_code == 200
+    print(batch, flush=True)
+    batch += 1
+"""
+
+
+# Imports 5 batches, then dies as soon as the first WAL record of the 6th is durable.
+IMPORT_WRITER = """
+import os, signal, app
+client = app.app.test_client()
+append = app.wal.append
+
+def append_then_crash(op, **payload):
+    seq = append(op, **payload)
+    app.wal.wait_durable(seq)
+    os.kill(os.getpid(), signal.SIGKILL)
+
+for batch in range(6):
+    if batch == 5:
+        app.wal.append = append_then_crash
+    body = ''.join(f'{{"title": "b{batch}-{i}"}}\\n' for i in range(50))
+    assert client.post('/api/import/tasks', data=body).get_json()['imported'] == 50
+    print(batch, flush=True)
+"""
+
+
+def _batch_sizes(titles):
+    sizes = {}
+    for title in titles:
+        batch = title.split('-')[0]
+        sizes[batch] = sizes.get(batch, 0) + 1
+    return sizes
+
+
+def test_acknowledged_writes_survive_a_crash(tmp_path):
+    acknowledged = _run_and_kill(tmp_path, """
+        import app
+        client = app.app.test_client()
+        for i in range(100000):
+            assert client.post('/api/tasks', json={'title': f't{i}'}).status_code == 201
+            print(f't{i}', flush=True)
+    """, acks=200, RHYTHM_WAL_FSYNC='always')
+
+    recovered = set(_recover(tmp_path)['tasks'])
+    assert set(acknowledged) <= recovered
+
+
+def test_bulk_batches_are_all_or_nothing_after_a_crash(tmp_path):
+    acknowledged = _run_and_kill(tmp_path, BULK_WRITER, acks=40, RHYTHM_WAL_FSYNC='off')
+
+    sizes = _batch_sizes(_recover(tmp_path)['tasks'])
+    assert set(sizes.values()) == {50}
+    assert {f'b{batch}' for batch in acknowledged} <= set(sizes)
+
+
+def test_import_batches_are_all_or_nothing_after_a_crash(tmp_path):
+    child = subprocess.run([sys.executable, '-c', IMPORT_WRITER], cwd=ROOT, env=_env(tmp_path, RHYTHM_WAL_FSYNC='always'),
+                           capture_output=True, text=True, timeout=120)
+    assert child.returncode == -signal.SIGKILL, child.stderr
+    acknowledged = child.stdout.split()
+
+    sizes = _batch_sizes(_recover(tmp_path)['tasks'])
+    assert set(sizes.values()) == {50}
+    assert {f'b{batch}' for batch in acknowledged} <= set(sizes)
+
+
+def test_torn_bulk_record_is_dropped_whole(tmp_path):
+    _run_and_kill(tmp_path, BULK_WRITER, acks=10, RHYTHM_WAL_FSYNC='off')
+    wal_path = tmp_path / 'wal.ndjson'
+    lines = wal_path.read_bytes().splitlines(keepends=True)
+    complete = [line for line in lines if line.endswith(b'\n')]
+    # Cut the last complete record in half, as a crash mid-write would.
+    wal_path.write_bytes(b''.join(complete[:-1]) + complete[-1][:len(complete[-1]) // 2])
+
+    sizes = _batch_sizes(_recover(tmp_path)['tasks'])
+    assert set(sizes.values()) == {50}
+    assert len(sizes) == len(complete) - 1
+
+
+def test_recovery_across_snapshot_rotation(tmp_path):
+    acknowledged = _run_and_kill(tmp_path, """
+        import app
+        client = app.app.test_client()
+        for i in range(100000):
+            assert client.post('/api/log_activity', json={'activity': f'a{i}'}).status_code == 200
+            print(f'a{i}', flush=True)
+    """, acks=500, RHYTHM_WAL_FSYNC='always', RHYTHM_SNAPSHOT_EVERY='64')
+
+    recovered = _recover(tmp_path)['activities']
+    assert recovered[:len(acknowledged)] == acknowledged
+    assert len(recovered) == len(set(recovered))
+
+    # A second start recovers from the compacted snapshot alone.
+    assert _recover(tmp_path)['activities'] == recovered